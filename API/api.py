@@ -1,10 +1,25 @@
 import os
-import shutil
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+import json
+import time
+import asyncio
+import argparse
+from typing import Optional
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse, Response
+from starlette.background import BackgroundTask
 import uvicorn
 import logging
+from PIL import Image
+from batching import MicroBatcher
+from worker_pool import WorkerPool, PoolFullError
+from jobs import JobManager, MemoryJobStore, SQLiteJobStore, QueueFullError
+from result_cache import ResultCache, cache_key
+from storage import Storage
+import metrics
+from metrics import stage_timer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,10 +33,195 @@ MODEL_DIR = os.path.join(ROOT_DIR, "Model_1")
 import sys
 sys.path.append(MODEL_DIR)  # Add Model directory to Python path
 
-# Import your GAN function
-from generate_image import generate_image
+def load_pipeline():
+    """Import the GAN pipeline (torch, torchvision, cv2 and the model code) into this module.
 
-app = FastAPI(title="VasthraAI API")
+    This is the slow part of startup, so it runs in the lifespan after the server is
+    already answering /healthz; generation endpoints wait for it through require_ready.
+    """
+    global torch, registry, VARIANTS, SKETCH_SIZE, OUTPUT_FORMATS
+    global load_sketch, sketch_to_tensor, prepare_generator_input, run_batched_forward, tensor_to_image
+    global output_paths, new_output_id, write_atomic, make_thumbnail, thumbnail_path, decode_sketch, encode_image
+    global model_variant, precision_context, tiled_generate, GENERATOR_NUMS
+    import torch
+    from generate_image import (
+        SKETCH_SIZE, OUTPUT_FORMATS, load_sketch, sketch_to_tensor, prepare_generator_input, run_batched_forward,
+        tensor_to_image, output_paths, new_output_id, write_atomic, make_thumbnail, thumbnail_path, decode_sketch,
+        encode_image, model_variant, precision_context, tiled_generate
+    )
+    from model_registry import registry, VARIANTS, GENERATOR_NUMS, configure_threads
+    configure_threads()
+
+# Import the pipeline in the background so the port is bound (and /healthz answers) within moments
+LAZY_STARTUP = os.environ.get("VASTHRA_LAZY_STARTUP", "1") == "1"
+# Run a dummy 512x512 pass through each preloaded generator before reporting ready
+WARMUP = os.environ.get("VASTHRA_WARMUP", "1") == "1"
+
+# Generators to load and warm at startup: "all" (every one with weights), comma-separated numbers such as
+# "1,2", or "none"; others load on first use
+PRELOAD_GENERATORS = os.environ.get("VASTHRA_PRELOAD_GENERATORS", "all")
+
+# Cross-request batching: wait up to this many ms for more sketches, up to this many rows per forward pass
+BATCH_WINDOW_MS = float(os.environ.get("VASTHRA_BATCH_WINDOW_MS", "20"))
+MAX_BATCH_SIZE = int(os.environ.get("VASTHRA_MAX_BATCH_SIZE", "8"))
+
+# Thread pool for preprocessing, inference and encoding; requests beyond MAX_PENDING get a 503
+WORKER_THREADS = int(os.environ.get("VASTHRA_WORKER_THREADS", "4"))
+MAX_PENDING_REQUESTS = int(os.environ.get("VASTHRA_MAX_PENDING_REQUESTS", "16"))
+REQUEST_TIMEOUT_S = float(os.environ.get("VASTHRA_REQUEST_TIMEOUT_S", "120"))
+
+pool = WorkerPool(max_workers=WORKER_THREADS, max_pending=MAX_PENDING_REQUESTS, timeout_s=REQUEST_TIMEOUT_S)
+
+# Asynchronous jobs: bounded queue, worker count and optional SQLite file to survive restarts
+MAX_QUEUED_JOBS = int(os.environ.get("VASTHRA_MAX_QUEUED_JOBS", "100"))
+JOB_WORKERS = int(os.environ.get("VASTHRA_JOB_WORKERS", "2"))
+JOB_DB_PATH = os.environ.get("VASTHRA_JOB_DB")
+# Worker processes only see each other's jobs through a shared store, so several workers always get one
+if not JOB_DB_PATH and int(os.environ.get("VASTHRA_WORKER_PROCESSES", "1")) > 1:
+    JOB_DB_PATH = os.path.join(MODEL_DIR, "jobs.sqlite")
+
+# Default inference precision (fp32, bf16 or int8); requests can override it
+DEFAULT_PRECISION = os.environ.get("VASTHRA_PRECISION", "fp32")
+
+# Largest tile allowed for full-resolution tiled requests, which caps their activation memory
+MAX_TILE_SIZE = int(os.environ.get("VASTHRA_MAX_TILE_SIZE", "1024"))
+
+# Whether /generate/stream also writes the upload, processed sketch and result to disk (in the background)
+PERSIST_INTERMEDIATES = os.environ.get("VASTHRA_PERSIST_INTERMEDIATES", "0") == "1"
+
+# Disk budget of the content-addressed result cache in OUTPUT_DIR, shared by all worker processes
+CACHE_MAX_MB = float(os.environ.get("VASTHRA_CACHE_MAX_MB", "1024"))
+
+# Allow a torch.profiler trace per request when it sends the PROFILE_HEADER header
+ENABLE_PROFILING = os.environ.get("VASTHRA_ENABLE_PROFILING", "0") == "1"
+
+# Output encoding; a low PNG compress level spends far less CPU in Image.save for slightly larger files
+PNG_COMPRESS_LEVEL = int(os.environ.get("VASTHRA_PNG_COMPRESS_LEVEL", "1"))
+WEBP_QUALITY = int(os.environ.get("VASTHRA_WEBP_QUALITY", "80"))
+JPEG_QUALITY = int(os.environ.get("VASTHRA_JPEG_QUALITY", "85"))
+# Longest side of the preview thumbnail made with every result
+THUMBNAIL_SIZE = int(os.environ.get("VASTHRA_THUMBNAIL_SIZE", "256"))
+
+# Uploads and results older than their TTL (hours) or beyond their quota (MB) are swept; 0 disables a limit
+UPLOAD_TTL_H = float(os.environ.get("VASTHRA_UPLOAD_TTL_H", "24"))
+UPLOAD_MAX_MB = float(os.environ.get("VASTHRA_UPLOAD_MAX_MB", "1024"))
+OUTPUT_TTL_H = float(os.environ.get("VASTHRA_OUTPUT_TTL_H", "168"))
+OUTPUT_MAX_MB = float(os.environ.get("VASTHRA_OUTPUT_MAX_MB", "4096"))
+SWEEP_INTERVAL_S = float(os.environ.get("VASTHRA_SWEEP_INTERVAL_S", "300"))
+
+# Progressive mode drafts with one pass of this generator, skipping the draft if it takes longer than the budget
+DRAFT_GENERATOR = int(os.environ.get("VASTHRA_DRAFT_GENERATOR", "2"))
+DRAFT_TIMEOUT_S = float(os.environ.get("VASTHRA_DRAFT_TIMEOUT_S", "2"))
+PROFILE_HEADER = "x-vasthra-profile"
+PROFILE_DIR = os.path.join(MODEL_DIR, "profiles")
+
+def run_generator_batch(key, inputs):
+    """Run the queued inputs for one (generator_num, variant, precision) as a single forward pass."""
+    generator_num, variant, precision = key
+    start = time.perf_counter()
+    generator = registry.get(generator_num, variant)
+    loaded = time.perf_counter()
+    results = run_batched_forward(generator, inputs, precision)
+    finished = time.perf_counter()
+
+    # Every request in the batch waited for the whole load and forward pass; several rows mean ensemble
+    metrics.BATCH_SIZE.labels(str(generator_num)).observe(sum(x.shape[0] for x in inputs))
+    for x in inputs:
+        metrics.observe_stage("model_load", generator_num, x.shape[0] > 1, loaded - start)
+        metrics.observe_stage("forward", generator_num, x.shape[0] > 1, finished - loaded)
+    return results
+
+batcher = MicroBatcher(run_generator_batch, window_ms=BATCH_WINDOW_MS, max_batch_size=MAX_BATCH_SIZE,
+                       executor=pool.executor)
+
+def warm_up(generator_nums, variant, precision):
+    """Run a dummy 512x512 ensemble-sized batch through each generator.
+
+    The first forward pass pays for allocator growth and kernel selection; doing it here
+    keeps that cost off the first real request.
+    """
+    for generator_num in generator_nums:
+        x = torch.zeros(3, 1, *SKETCH_SIZE, device=registry.device)
+        run_batched_forward(registry.get(generator_num, variant), [x], precision)
+        if registry.device.type == "cuda":
+            torch.cuda.synchronize()
+
+# Startup progress reported by /readyz; `ready` is set once, when the indexes are rebuilt and the pipeline
+# is imported, preloaded and warmed up (the registry may evict preloaded generators later)
+startup = {"ready": False, "error": None, "preloaded": [], "timings_s": {}}
+pipeline_ready = asyncio.Event()
+
+def preload_generator_nums():
+    """Parse VASTHRA_PRELOAD_GENERATORS; registry.preload skips generators without weights."""
+    setting = PRELOAD_GENERATORS.strip().lower()
+    if setting == "all":
+        return list(GENERATOR_NUMS)
+    if setting in ("", "none"):
+        return []
+    return [int(num) for num in setting.split(",") if num.strip()]
+
+async def rebuild_indexes():
+    """Re-index the upload and output directories if needed, start their sweepers and rebuild the result cache."""
+    timings = startup["timings_s"]
+    start = time.perf_counter()
+    for storage in (uploads, outputs):
+        await pool.run(storage.rebuild_if_empty)
+        storage.start_sweeper(SWEEP_INTERVAL_S)
+    timings["storage"] = time.perf_counter() - start
+    phase_start = time.perf_counter()
+    await pool.run(result_cache.rebuild)
+    timings["result_cache"] = time.perf_counter() - phase_start
+
+async def start_pipeline():
+    """Rebuild the indexes while importing the pipeline, then preload and warm up the chosen generators."""
+    timings = startup["timings_s"]
+    indexes = asyncio.create_task(rebuild_indexes())
+    try:
+        start = time.perf_counter()
+        await pool.run(load_pipeline)
+        timings["imports"] = time.perf_counter() - start
+
+        generator_nums = preload_generator_nums()
+        variant = model_variant(None, DEFAULT_PRECISION)
+        if generator_nums:
+            phase_start = time.perf_counter()
+            startup["preloaded"] = await pool.run(registry.preload, generator_nums, variant)
+            timings["preload"] = time.perf_counter() - phase_start
+            logger.info(f"Preloaded generators: {startup['preloaded']}")
+        if WARMUP and startup["preloaded"]:
+            phase_start = time.perf_counter()
+            await pool.run(warm_up, startup["preloaded"], variant, DEFAULT_PRECISION)
+            timings["warmup"] = time.perf_counter() - phase_start
+        await indexes
+        timings["pipeline_total"] = time.perf_counter() - start
+    except Exception as e:
+        startup["error"] = str(e)
+        logger.error(f"Startup failed: {e}", exc_info=True)
+        return
+    startup["ready"] = True
+    pipeline_ready.set()
+    logger.info("Pipeline ready: " + ", ".join(f"{phase} {seconds:.2f} s" for phase, seconds in timings.items()))
+
+@asynccontextmanager
+async def lifespan(app):
+    start = time.perf_counter()
+    await jobs.start()
+    logger.info(f"Server started in {time.perf_counter() - start:.2f} s")
+
+    pipeline_task = asyncio.create_task(start_pipeline())
+    if not LAZY_STARTUP:
+        await pipeline_task
+    yield
+    pipeline_task.cancel()
+    await jobs.stop()
+    await batcher.close()
+    pool.shutdown()
+    for storage in (uploads, outputs):
+        storage.close()
+    if startup["ready"]:
+        registry.clear()
+
+app = FastAPI(title="VasthraAI API", lifespan=lifespan)
 
 # Add CORS middleware to allow requests from frontend
 app.add_middleware(
@@ -41,62 +241,390 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 logger.info(f"Uploads directory: {UPLOAD_DIR}")
 logger.info(f"Generated images directory: {OUTPUT_DIR}")
 
-# Mount the directories to serve files statically
+# The indexes live beside, not inside, the statically served directories
+uploads = Storage(UPLOAD_DIR, ttl_s=UPLOAD_TTL_H * 3600, max_bytes=UPLOAD_MAX_MB * 2**20,
+                  index_path=f"{UPLOAD_DIR}.index.sqlite")
+outputs = Storage(OUTPUT_DIR, ttl_s=OUTPUT_TTL_H * 3600, max_bytes=OUTPUT_MAX_MB * 2**20,
+                  index_path=f"{OUTPUT_DIR}.index.sqlite")
+result_cache = ResultCache(OUTPUT_DIR, max_bytes=CACHE_MAX_MB * 2**20, storage=outputs)
+
+# Mount the directories to serve files statically; URLs include the shard directories
 app.mount("/images", StaticFiles(directory=OUTPUT_DIR), name="images")
 app.mount("/sketches", StaticFiles(directory=UPLOAD_DIR), name="sketches")
 
+def save_upload(data, sketch_path):
+    """Write uploaded bytes to disk."""
+    write_atomic(sketch_path, data)
+
+def store_upload(data, filename):
+    """Save uploaded bytes under a unique name in their shard of UPLOAD_DIR and index them."""
+    filename_parts = os.path.splitext(filename)
+    unique_filename = f"{filename_parts[0]}_{new_output_id()}{filename_parts[1]}"
+    relpath, sketch_path = uploads.path_for(unique_filename)
+    logger.info(f"Saving uploaded sketch to: {sketch_path}")
+    save_upload(data, sketch_path)
+    uploads.add(relpath)
+    return sketch_path
+
+def result_paths(output_id=None, fmt="png"):
+    """Return the generated image and processed sketch paths for a new result in its shard of OUTPUT_DIR.
+
+    ``output_id`` is a cache key or a new random identifier; both are hex, so they also pick the shard.
+    """
+    output_id = output_id or new_output_id()
+    return output_paths(outputs.shard_dir(output_id), output_id=output_id, fmt=fmt)
+
+def prepare_sketch(sketch_path, sketch_output_path, options):
+    """Preprocess a sketch, save it for comparison and build its generator input."""
+    with stage_timer("preprocess", options):
+        sketch = load_sketch(sketch_path, enhance_sketch=options["enhance_sketch"])
+        inputs = generator_input(sketch, options)
+    with stage_timer("write", options):
+        write_atomic(sketch_output_path, encode_image(sketch, "png", **encode_options("png")))
+    return inputs
+
+def generator_input(sketch, options):
+    """Full-resolution tensor for tiled requests, otherwise the 512x512 input queued for batching."""
+    if options["tile_size"]:
+        return sketch_to_tensor(sketch, size=None)
+    return prepare_generator_input(sketch_to_tensor(sketch), ensemble=options["ensemble"], seed=options["seed"])
+
+def run_tiled(sketch_tensor, options):
+    """Generate a full-resolution sketch tile by tile; runs on its own since its size differs per request."""
+    with stage_timer("model_load", options):
+        generator = registry.get(options["generator_num"], options["variant"])
+    with stage_timer("forward", options), torch.no_grad(), precision_context(options["precision"]):
+        return tiled_generate(generator, sketch_tensor, options["tile_size"], options["tile_overlap"],
+                              ensemble=options["ensemble"], seed=options["seed"])
+
+def run_profiled(inputs, options, trace_path):
+    """Generate one request on its own under torch.profiler and write a Chrome trace."""
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    with torch.profiler.profile(activities=activities, record_shapes=True) as profiler:
+        if options["tile_size"]:
+            generated_image = run_tiled(inputs, options)
+        else:
+            generated_image = run_generator_batch(batch_key(options), [inputs])[0]
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.export_chrome_trace(trace_path)
+    return generated_image
+
+async def run_generation(inputs, options, trace_path=None):
+    """Generate from a prepared input, through the batcher unless the request is tiled or profiled."""
+    if trace_path:
+        return await pool.run(run_profiled, inputs, options, trace_path)
+    if options["tile_size"]:
+        return await pool.run(run_tiled, inputs, options)
+    return await batcher.submit(batch_key(options), inputs)
+
+def encode_options(fmt):
+    """Configured encoder settings for a format, as encode_image keyword arguments."""
+    if fmt == "png":
+        return {"compress_level": PNG_COMPRESS_LEVEL}
+    return {"quality": WEBP_QUALITY if fmt == "webp" else JPEG_QUALITY}
+
+def negotiate_format(accept, formats, default):
+    """Pick the format the Accept header rates highest, ties going to the earlier one in formats."""
+    best, best_q = default, 0.0
+    for fmt in formats:
+        for part in (accept or "").split(","):
+            media_type, *params = [item.strip() for item in part.split(";")]
+            if media_type != OUTPUT_FORMATS[fmt][2]:
+                continue
+            q = 1.0
+            for param in params:
+                if param.startswith("q="):
+                    try:
+                        q = float(param[2:])
+                    except ValueError:
+                        q = 0.0
+            if q > best_q:
+                best, best_q = fmt, q
+    return best
+
+def image_format(fmt, field):
+    """Normalize a format form field, rejecting formats encode_image cannot write."""
+    fmt = fmt.lower()
+    if fmt not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported {field}: {fmt}")
+    return fmt
+
+def save_generated(generated_image, output_path, options, thumbnail_fmt):
+    """Save a generator output in its output format along with a preview thumbnail; return the thumbnail path."""
+    fmt = options["output_format"]
+    with stage_timer("postprocess", options):
+        image = tensor_to_image(generated_image)
+        body = encode_image(image, fmt, **encode_options(fmt))
+        preview_path = thumbnail_path(output_path, thumbnail_fmt)
+        preview = encode_image(make_thumbnail(image, THUMBNAIL_SIZE), thumbnail_fmt, **encode_options(thumbnail_fmt))
+    with stage_timer("write", options):
+        write_atomic(output_path, body)
+        write_atomic(preview_path, preview)
+    return preview_path
+
+def ensure_thumbnail(output_path, fmt):
+    """Make the thumbnail of an earlier result in the given format if it has none yet; return its path."""
+    preview_path = thumbnail_path(output_path, fmt)
+    if not os.path.exists(preview_path):
+        with Image.open(output_path) as image:
+            preview = make_thumbnail(image.convert("RGB"), THUMBNAIL_SIZE)
+        write_atomic(preview_path, encode_image(preview, fmt, **encode_options(fmt)))
+        outputs.add(outputs.relpath(preview_path))
+    return preview_path
+
+def prepare_sketch_bytes(data, options):
+    """Decode and preprocess an upload in memory; return the processed sketch and generator input."""
+    with stage_timer("preprocess", options):
+        sketch = load_sketch(decode_sketch(data), enhance_sketch=options["enhance_sketch"])
+        return sketch, generator_input(sketch, options)
+
+def encode_generated(generated_image, fmt, options):
+    with stage_timer("postprocess", options):
+        return encode_image(tensor_to_image(generated_image), fmt, **encode_options(fmt))
+
+def persist_intermediates(data, filename, sketch, body, fmt):
+    """Write the upload, processed sketch and encoded result to disk."""
+    store_upload(data, filename)
+    output_path, sketch_output_path = result_paths(fmt=fmt)
+    write_atomic(sketch_output_path, encode_image(sketch, "png", **encode_options("png")))
+    write_atomic(output_path, body)
+    outputs.add(outputs.relpath(output_path))
+    outputs.add(outputs.relpath(sketch_output_path))
+
+def generator_number(generator):
+    """Map the generator selection to model number."""
+    if generator == "Generator 2":
+        return 2
+    elif generator == "Generator 3":
+        return 3
+    return 1  # Default
+
+def admit(endpoint, options):
+    """Take a worker pool slot for a request, or turn it away with a 503; the caller releases the slot."""
+    try:
+        pool.acquire()
+    except PoolFullError as e:
+        logger.warning(f"Rejecting request: {e}")
+        metrics.count_request(endpoint, options, "rejected")
+        raise HTTPException(status_code=503, detail="Server is busy, try again later",
+                            headers={"Retry-After": "1"})
+
+async def run_admitted(coro, endpoint, options):
+    """Run a request coroutine with admission control and the per-request timeout."""
+    try:
+        admit(endpoint, options)
+    except HTTPException:
+        coro.close()
+        raise
+    try:
+        result = await asyncio.wait_for(coro, timeout=pool.timeout_s)
+        metrics.count_request(endpoint, options, "cached" if isinstance(result, dict) and result.get("cached") else "ok")
+        return result
+    except asyncio.TimeoutError:
+        # Work already running on the pool finishes in the background
+        logger.error(f"Request timed out after {pool.timeout_s} s")
+        metrics.count_request(endpoint, options, "timeout")
+        raise HTTPException(status_code=504, detail="Generation timed out")
+    except HTTPException:
+        metrics.count_request(endpoint, options, "error")
+        raise
+    finally:
+        pool.release()
+        refresh_gauges()
+
+def profile_trace_path(request):
+    """Return where to write a profiler trace if this request asked for one (and profiling is enabled)."""
+    if not ENABLE_PROFILING or request.headers.get(PROFILE_HEADER) not in ("1", "true"):
+        return None
+    return os.path.join(PROFILE_DIR, f"trace_{time.strftime('%Y%m%d_%H%M%S')}_{new_output_id()}.json")
+
+def require_ready():
+    """Turn requests away with a 503 until the pipeline is imported and warmed up."""
+    if not startup["ready"]:
+        detail = f"Startup failed: {startup['error']}" if startup["error"] else "Server is starting, try again shortly"
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "5"})
+
+def generation_options(
+    generator: str = Form("Generator 1"),
+    enhance_sketch: bool = Form(True),
+    ensemble: bool = Form(True),
+    seed: Optional[int] = Form(None),
+    variant: Optional[str] = Form(None),
+    precision: str = Form(DEFAULT_PRECISION),
+    tile_size: Optional[int] = Form(None),
+    tile_overlap: int = Form(64),
+):
+    """Dependency collecting the form fields every generation endpoint shares.
+
+    Results are stored as PNG unless the endpoint sets ``output_format`` from its own field.
+    """
+    require_ready()
+    if variant is not None and variant not in VARIANTS:
+        raise HTTPException(status_code=400, detail=f"Unknown model variant: {variant}")
+    if tile_size is not None and (tile_size % 4 or not 64 <= tile_size <= MAX_TILE_SIZE):
+        raise HTTPException(status_code=400, detail=f"tile_size must be a multiple of 4 between 64 and {MAX_TILE_SIZE}")
+    if tile_size is not None and not 0 <= tile_overlap < tile_size // 2:
+        raise HTTPException(status_code=400, detail="tile_overlap must be smaller than half the tile size")
+    try:
+        variant = model_variant(variant, precision)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "generator_num": generator_number(generator),
+        "enhance_sketch": enhance_sketch,
+        "ensemble": ensemble,
+        "seed": seed,
+        "variant": variant,
+        "precision": precision,
+        "tile_size": tile_size,
+        "tile_overlap": tile_overlap,
+        "output_format": "png",
+    }
+
+def batch_key(options):
+    """Requests are batched together per generator, model variant and precision."""
+    return options["generator_num"], options["variant"], options["precision"]
+
+def result_urls(generated_image_filename, sketch_filename, thumbnail_filename=None):
+    urls = {
+        "generated_image": f"/images/{generated_image_filename}",
+        "original_sketch": f"/images/{sketch_filename}"  # Changed to images directory!
+    }
+    if thumbnail_filename:
+        urls["thumbnail"] = f"/images/{thumbnail_filename}"
+    return urls
+
+async def cached_result_urls(cached, thumbnail_fmt):
+    """Result URLs for a cache hit, making the thumbnail if the format was not requested before."""
+    generated_image_filename, sketch_filename = cached
+    preview_path = await pool.run(ensure_thumbnail, outputs.abspath(generated_image_filename), thumbnail_fmt)
+    return result_urls(generated_image_filename, sketch_filename, outputs.relpath(preview_path))
+
 @app.post("/generate/")
-async def generate_design(file: UploadFile = File(...), generator: str = Form("Generator 1")):
+async def generate_design(
+    request: Request,
+    file: UploadFile = File(...),
+    options: dict = Depends(generation_options),
+    output_format: str = Form("png"),
+    thumbnail_format: str = Form("webp"),
+):
+    options["output_format"] = image_format(output_format, "output_format")
+    thumbnail_fmt = image_format(thumbnail_format, "thumbnail_format")
+    return await run_admitted(
+        _generate_design(file, options, thumbnail_fmt, profile_trace_path(request)), "generate", options
+    )
+
+@app.post("/generate/stream")
+async def generate_design_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    options: dict = Depends(generation_options),
+    output_format: Optional[str] = Form(None),
+    persist: bool = Form(PERSIST_INTERMEDIATES),
+):
+    """Generate entirely in memory and return the image itself as the response body
+
+    The format is output_format if given, otherwise negotiated from the Accept header (PNG by default).
+    """
+    if output_format:
+        options["output_format"] = image_format(output_format, "output_format")
+    else:
+        options["output_format"] = negotiate_format(request.headers.get("accept"), ("webp", "jpeg", "png"), "png")
+    fmt = options["output_format"]
+    return await run_admitted(_generate_design_stream(file, options, fmt, persist), "generate_stream", options)
+
+async def _generate_design_stream(file, options, fmt, persist):
     try:
-        # Generate a unique filename to avoid conflicts
-        filename_parts = os.path.splitext(file.filename)
-        unique_filename = f"{filename_parts[0]}_{os.urandom(4).hex()}{filename_parts[1]}"
-        
-        # Save the uploaded file
-        sketch_path = os.path.join(UPLOAD_DIR, unique_filename)
-        logger.info(f"Saving uploaded sketch to: {sketch_path}")
-        
-        with open(sketch_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Map the generator selection to model number
-        generator_num = 1  # Default
-        if generator == "Generator 2":
-            generator_num = 2
-        elif generator == "Generator 3":
-            generator_num = 3
-            
-        logger.info(f"Using generator model: {generator_num}")
-        
-        # Generate the image using your existing generate_image function
-        logger.info(f"Generating image from sketch: {sketch_path}")
-        output_path, sketch_output_path = generate_image(
-            sketch_path=sketch_path,
-            output_dir=OUTPUT_DIR,
-            generator_num=generator_num  # Pass the generator number
-        )
-        
-        # Log the output paths
-        logger.info(f"Generated image path: {output_path}")
-        logger.info(f"Processed sketch path: {sketch_output_path}")
-        
-        # Get the filenames for the paths
-        generated_image_filename = os.path.basename(output_path)
-        sketch_filename = os.path.basename(sketch_output_path)
-        
-        # Verify files exist
-        if not os.path.exists(output_path):
-            logger.error(f"Generated image not found at: {output_path}")
-        
-        if not os.path.exists(sketch_output_path):
-            logger.error(f"Processed sketch not found at: {sketch_output_path}")
-        
-        # Return the URLs to access these files
-        response_data = {
-            "success": True,
-            "generated_image": f"/images/{generated_image_filename}",
-            "original_sketch": f"/images/{sketch_filename}"  # Changed to images directory!
-        }
+        data = await file.read()
+        try:
+            sketch, inputs = await pool.run(prepare_sketch_bytes, data, options)
+        except ValueError as e:
+            # decode_sketch could not read the upload as an image
+            raise HTTPException(status_code=400, detail=str(e))
+        generated_image = await run_generation(inputs, options)
+        body = await pool.run(encode_generated, generated_image, fmt, options)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing request: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # Writing intermediates is optional and happens after the response is sent
+    background = None
+    if persist:
+        background = BackgroundTask(pool.run, persist_intermediates, data, file.filename, sketch, body, fmt)
+    return Response(content=body, media_type=OUTPUT_FORMATS[fmt][2], headers={"Vary": "Accept"},
+                    background=background)
+
+async def save_uploaded_sketch(file, options):
+    """Save an uploaded sketch under a unique filename and return its path."""
+    data = await file.read()
+    with stage_timer("upload_save", options):
+        return await pool.run(store_upload, data, file.filename)
+
+async def upload_cache_key(file, options):
+    """Hash the uploaded bytes with the generation options, leaving the upload ready to re-read."""
+    data = await file.read()
+    await file.seek(0)
+    return await pool.run(cache_key, data, **options)
+
+async def generate_from_path(sketch_path, options, key=None, trace_path=None, thumbnail_fmt="webp"):
+    """Run the generation pipeline for a saved sketch and return the result URLs.
+
+    With a cache key, the result is named after it and recorded in the result cache.
+    With a trace path, inference runs alone under torch.profiler.
+    """
+    generator_num = options["generator_num"]
+    logger.info(f"Using generator model: {generator_num}")
+
+    # Preprocess the sketch and save it for comparison
+    logger.info(f"Generating image from sketch: {sketch_path}")
+    output_path, sketch_output_path = result_paths(key, options["output_format"])
+    inputs = await pool.run(prepare_sketch, sketch_path, sketch_output_path, options)
+
+    # Queue the sketch with other concurrent requests for the same generator
+    generated_image = await run_generation(inputs, options, trace_path)
+    preview_path = await pool.run(save_generated, generated_image, output_path, options, thumbnail_fmt)
+    generated_image_filename = outputs.relpath(output_path)
+    sketch_filename = outputs.relpath(sketch_output_path)
+    thumbnail_filename = outputs.relpath(preview_path)
+    for relpath in (generated_image_filename, sketch_filename, thumbnail_filename):
+        await pool.run(outputs.add, relpath)
+    if key is not None:
+        await pool.run(result_cache.add, key, OUTPUT_FORMATS[options["output_format"]][1])
+
+    # Log the output paths
+    logger.info(f"Generated image path: {output_path}")
+    logger.info(f"Processed sketch path: {sketch_output_path}")
+
+    # Verify files exist
+    if not os.path.exists(output_path):
+        logger.error(f"Generated image not found at: {output_path}")
+
+    if not os.path.exists(sketch_output_path):
+        logger.error(f"Processed sketch not found at: {sketch_output_path}")
+
+    # Return the URLs to access these files
+    result = result_urls(generated_image_filename, sketch_filename, thumbnail_filename)
+    if trace_path:
+        result["profile_trace"] = trace_path
+    return result
+
+async def _generate_design(file, options, thumbnail_fmt, trace_path=None):
+    try:
+        # Identical sketches with identical options are served from the cache without the model
+        key = await upload_cache_key(file, options)
+        cached = None if trace_path else result_cache.get(key)
+        if cached is not None:
+            logger.info(f"Result cache hit: {key}")
+            response_data = {"success": True, "cached": True, **await cached_result_urls(cached, thumbnail_fmt)}
+            return response_data
+
+        sketch_path = await save_uploaded_sketch(file, options)
+        result = await generate_from_path(sketch_path, options, key, trace_path, thumbnail_fmt)
+        response_data = {"success": True, **result}
         
         logger.info(f"Response data: {response_data}")
         return response_data
@@ -105,26 +633,267 @@ async def generate_design(file: UploadFile = File(...), generator: str = Form("G
         logger.error(f"Error processing request: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+def draft_options(options):
+    """Options for the quick draft of a request: one pass of the draft generator at 512x512, no ensemble."""
+    return {
+        **options,
+        "generator_num": DRAFT_GENERATOR,
+        "ensemble": False,
+        "variant": model_variant(None, options["precision"]),
+        "tile_size": None,
+        "tile_overlap": 64,
+    }
+
+async def cached_or_generate(data, sketch_path, options, thumbnail_fmt):
+    """Result URLs for a saved upload from the result cache, or from a new generation recorded in it."""
+    key = await pool.run(cache_key, data, **options)
+    cached = result_cache.get(key)
+    if cached is not None:
+        return {"cached": True, **await cached_result_urls(cached, thumbnail_fmt)}
+    return await generate_from_path(sketch_path, options, key, thumbnail_fmt=thumbnail_fmt)
+
+def sse_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/generate/progressive")
+async def generate_design_progressive(
+    file: UploadFile = File(...),
+    options: dict = Depends(generation_options),
+    output_format: str = Form("png"),
+    thumbnail_format: str = Form("webp"),
+):
+    """Stream a quick draft and then the full-quality result as server-sent events
+
+    The draft, a single pass of VASTHRA_DRAFT_GENERATOR without ensemble, and the requested
+    render start together. The draft is sent as a `draft` event if it finishes within
+    VASTHRA_DRAFT_TIMEOUT_S and before the render, which follows as a `final` event. If the
+    client disconnects, both are cancelled.
+    """
+    options["output_format"] = image_format(output_format, "output_format")
+    thumbnail_fmt = image_format(thumbnail_format, "thumbnail_format")
+    admit("generate_progressive", options)
+    try:
+        data = await file.read()
+    except BaseException:
+        pool.release()
+        raise
+    state = {"outcome": "cancelled"}
+
+    async def stream():
+        tasks = []
+        try:
+            with stage_timer("upload_save", options):
+                sketch_path = await pool.run(store_upload, data, file.filename)
+            draft = asyncio.create_task(cached_or_generate(data, sketch_path, draft_options(options), thumbnail_fmt))
+            refinement = asyncio.create_task(asyncio.wait_for(
+                cached_or_generate(data, sketch_path, options, thumbnail_fmt), timeout=pool.timeout_s
+            ))
+            tasks = [draft, refinement]
+            done, _ = await asyncio.wait(tasks, timeout=DRAFT_TIMEOUT_S, return_when=asyncio.FIRST_COMPLETED)
+            if refinement in done:
+                # The full result is ready, so a draft would only delay it
+                draft.cancel()
+            elif draft in done and draft.exception() is None:
+                yield sse_event("draft", {"success": True, **draft.result()})
+            else:
+                # A slow or failed draft must not hold up the real result
+                draft.cancel()
+                logger.warning(f"Draft skipped: {draft.exception() if draft in done else 'over the latency budget'}")
+
+            yield sse_event("final", {"success": True, **await refinement})
+            state["outcome"] = "ok"
+        except asyncio.TimeoutError:
+            logger.error(f"Refinement timed out after {pool.timeout_s} s")
+            state["outcome"] = "timeout"
+            yield sse_event("error", {"success": False, "detail": "Generation timed out"})
+        except Exception as e:
+            logger.error(f"Error processing request: {str(e)}", exc_info=True)
+            state["outcome"] = "error"
+            yield sse_event("error", {"success": False, "detail": str(e)})
+        finally:
+            # On a client disconnect the response task is cancelled here; stop the work it was waiting for
+            for task in tasks:
+                task.cancel()
+            if state["outcome"] == "cancelled":
+                logger.info("Client disconnected, cancelled progressive generation")
+
+    def finish():
+        # A background task runs even when the client disconnects before the stream starts
+        pool.release()
+        metrics.count_request("generate_progressive", options, state["outcome"])
+        refresh_gauges()
+
+    return StreamingResponse(stream(), media_type="text/event-stream", background=BackgroundTask(finish))
+
+async def run_job(params):
+    """Job handler: generate from the sketch saved when the job was submitted."""
+    # Jobs resumed at startup wait for the pipeline
+    await pipeline_ready.wait()
+    # Jobs queued before thumbnails or output formats existed have neither
+    thumbnail_fmt = params.get("thumbnail_format", "webp")
+    options = {"output_format": "png", **params["options"]}
+    cached = result_cache.get(params["cache_key"])
+    if cached is not None:
+        return await cached_result_urls(cached, thumbnail_fmt)
+    return await asyncio.wait_for(
+        generate_from_path(params["sketch_path"], options, params["cache_key"],
+                           thumbnail_fmt=thumbnail_fmt),
+        timeout=pool.timeout_s
+    )
+
+jobs = JobManager(
+    run_job,
+    store=SQLiteJobStore(JOB_DB_PATH) if JOB_DB_PATH else MemoryJobStore(),
+    max_queued=MAX_QUEUED_JOBS,
+    num_workers=JOB_WORKERS,
+)
+
+@app.post("/jobs")
+async def create_job(
+    file: UploadFile = File(...),
+    options: dict = Depends(generation_options),
+    output_format: str = Form("png"),
+    thumbnail_format: str = Form("webp"),
+):
+    """Queue a generation job and return its id immediately"""
+    if jobs.queue_depth() >= jobs.max_queued:
+        raise HTTPException(status_code=429, detail="Too many queued jobs, try again later",
+                            headers={"Retry-After": "5"})
+    try:
+        options["output_format"] = image_format(output_format, "output_format")
+        thumbnail_fmt = image_format(thumbnail_format, "thumbnail_format")
+        key = await upload_cache_key(file, options)
+        sketch_path = await save_uploaded_sketch(file, options)
+        job = jobs.submit({"sketch_path": sketch_path, "options": options, "cache_key": key,
+                           "thumbnail_format": thumbnail_fmt})
+    except QueueFullError:
+        raise HTTPException(status_code=429, detail="Too many queued jobs, try again later",
+                            headers={"Retry-After": "5"})
+    return {"job_id": job.id, "status": job.status, "events": f"/jobs/{job.id}/events"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Report whether a job is queued, running, done or failed"""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Stream job status changes as server-sent events until the job finishes"""
+    if jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def stream():
+        async for state in jobs.events(job_id):
+            yield f"event: {state['status']}\ndata: {json.dumps(state)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+def refresh_gauges():
+    """Update the gauges that are sampled rather than counted."""
+    for queue, depth in batcher.queue_depth().items():
+        metrics.QUEUE_DEPTH.labels(f"batch_{queue}").set(depth)
+    metrics.QUEUE_DEPTH.labels("jobs").set(jobs.queue_depth())
+    metrics.QUEUE_DEPTH.labels("in_flight").set(pool.in_flight)
+    if startup["ready"]:
+        metrics.RESIDENT_MODELS.set(len(registry.resident()))
+        metrics.DEVICE.labels(str(registry.device)).set(1)
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and its event loop is responding"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once startup has imported the pipeline and preloaded and warmed its generators"""
+    body = {
+        "ready": startup["ready"],
+        "error": startup["error"],
+        "preloaded_generators": startup["preloaded"],
+        "resident_generators": [num for num, _ in registry.resident()] if startup["ready"] else [],
+        "startup_s": startup["timings_s"],
+    }
+    return Response(content=json.dumps(body), media_type="application/json", status_code=200 if body["ready"] else 503)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus metrics: per-stage latency histograms, request counters and queue gauges"""
+    refresh_gauges()
+    body, content_type = metrics.render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters and size of the result cache"""
+    return result_cache.stats()
+
+@app.get("/batching/stats")
+async def batching_stats():
+    """Latency, batch-size histogram and queue depth of the batching scheduler"""
+    return batcher.snapshot()
+
+STORAGE_AREAS = {"uploads": uploads, "outputs": outputs}
+
+@app.get("/files/{area}")
+async def list_files(area: str, offset: int = 0, limit: int = 100):
+    """Paginated listing of uploaded sketches or generated results, newest first"""
+    if area not in STORAGE_AREAS:
+        raise HTTPException(status_code=404, detail=f"Unknown area {area}, expected one of {list(STORAGE_AREAS)}")
+    if offset < 0 or not 1 <= limit <= 1000:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit between 1 and 1000")
+    return await pool.run(STORAGE_AREAS[area].list, offset, limit)
+
+@app.get("/storage/stats")
+async def storage_stats():
+    """File counts, sizes and limits of the upload and output directories"""
+    return {area: await pool.run(storage.usage) for area, storage in STORAGE_AREAS.items()}
+
 @app.get("/test-paths")
-async def test_paths():
+async def test_paths(limit: int = 20):
     """Endpoint to test if directories are accessible"""
     try:
-        upload_files = os.listdir(UPLOAD_DIR)
-        output_files = os.listdir(OUTPUT_DIR)
+        # The newest files only; /files/{area} pages through the rest
+        upload_files = [f["path"] for f in uploads.list(limit=limit)["files"]]
+        output_files = [f["path"] for f in outputs.list(limit=limit)["files"]]
         
         return {
             "upload_dir": UPLOAD_DIR,
             "output_dir": OUTPUT_DIR,
             "upload_files": upload_files,
             "output_files": output_files,
-            "mount_points": ["/images", "/sketches"]
+            "mount_points": ["/images", "/sketches"],
+            "models": registry.stats() if startup["ready"] else None
         }
     except Exception as e:
         logger.error(f"Error in test-paths: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the VasthraAI API server.")
+    parser.add_argument("--host", type=str, default="0.0.0.0", help="Host to bind. Default is 0.0.0.0.")
+    parser.add_argument("--port", type=int, default=8000, help="Port to bind. Default is 8000.")
+    parser.add_argument(
+        "--prod",
+        action="store_true",
+        help="Production mode: no auto-reload, several worker processes."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=2,
+        help="Number of uvicorn worker processes in production mode. Default is 2."
+    )
+    args = parser.parse_args()
+
     logger.info(f"Starting server with upload dir: {UPLOAD_DIR}")
     logger.info(f"Output dir: {OUTPUT_DIR}")
     logger.info(f"Model dir: {MODEL_DIR}")
-    uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    if args.prod:
+        # Worker processes split the cores between their torch thread pools (see configure_threads)
+        os.environ.setdefault("VASTHRA_WORKER_PROCESSES", str(args.workers))
+        uvicorn.run("api:app", host=args.host, port=args.port, reload=False, workers=args.workers)
+    else:
+        uvicorn.run("api:app", host=args.host, port=args.port, reload=True)
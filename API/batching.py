@@ -0,0 +1,158 @@
+import asyncio
+import bisect
+import time
+from collections import Counter, deque
+
+# Upper bounds (ms) of the per-request latency histogram buckets
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+class BatchingStats:
+    """Counters used to tune the batching window against throughput."""
+
+    def __init__(self, recent=1000):
+        self.batch_sizes = Counter()
+        self.latency_counts = [0] * len(LATENCY_BUCKETS_MS)
+        self.recent_latencies_ms = deque(maxlen=recent)
+        self.requests = 0
+        self.batches = 0
+
+    def record_batch(self, rows):
+        self.batches += 1
+        self.batch_sizes[rows] += 1
+
+    def record_latency(self, latency_ms):
+        self.requests += 1
+        self.latency_counts[bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+        self.recent_latencies_ms.append(latency_ms)
+
+    def snapshot(self):
+        recent = sorted(self.recent_latencies_ms)
+
+        def percentile(p):
+            return recent[min(len(recent) - 1, int(p / 100 * len(recent)))] if recent else None
+
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            # Batch sizes are in rows, the same unit as max_batch_size
+            "mean_batch_rows": sum(k * v for k, v in self.batch_sizes.items()) / self.batches if self.batches else None,
+            "batch_rows_histogram": dict(sorted(self.batch_sizes.items())),
+            "latency_ms_histogram": {
+                ("+Inf" if bound == float("inf") else str(bound)): count
+                for bound, count in zip(LATENCY_BUCKETS_MS, self.latency_counts)
+            },
+            "latency_ms_p50": percentile(50),
+            "latency_ms_p95": percentile(95),
+            "latency_ms_p99": percentile(99),
+        }
+
+class _Pending:
+    def __init__(self, inputs, future):
+        self.inputs = inputs
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+class MicroBatcher:
+    """Collects concurrent requests per key and runs them as one batched call.
+
+    ``run_batch(key, inputs)`` is called in ``executor`` with the list of queued
+    inputs and must return one result per input, in order. A batch is dispatched
+    once ``window_ms`` has passed since its first request or once its rows reach
+    ``max_batch_size``; each input contributes ``len(input)`` rows. A request that
+    would overshoot the cap waits for the next batch (one larger than the cap runs
+    alone).
+    """
+
+    def __init__(self, run_batch, window_ms=20, max_batch_size=8, executor=None):
+        self.run_batch = run_batch
+        self.window_ms = window_ms
+        self.max_batch_size = max_batch_size
+        self.executor = executor
+        self.stats = BatchingStats()
+        self._queues = {}
+        self._workers = {}
+        # Per key, the request that did not fit in the previous batch
+        self._carried = {}
+
+    async def submit(self, key, inputs):
+        """Queue inputs under key and wait for their result."""
+        future = asyncio.get_running_loop().create_future()
+        pending = _Pending(inputs, future)
+        self._queue(key).put_nowait(pending)
+        try:
+            return await future
+        finally:
+            self.stats.record_latency((time.perf_counter() - pending.enqueued_at) * 1000)
+
+    def queue_depth(self):
+        return {str(key): queue.qsize() + (key in self._carried) for key, queue in self._queues.items()}
+
+    def snapshot(self):
+        snapshot = self.stats.snapshot()
+        snapshot["queue_depth"] = self.queue_depth()
+        snapshot["window_ms"] = self.window_ms
+        snapshot["max_batch_size"] = self.max_batch_size
+        return snapshot
+
+    async def close(self):
+        for worker in self._workers.values():
+            worker.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._workers.clear()
+        self._queues.clear()
+        self._carried.clear()
+
+    def _queue(self, key):
+        if key not in self._queues:
+            self._queues[key] = asyncio.Queue()
+            self._workers[key] = asyncio.create_task(self._worker(key))
+        return self._queues[key]
+
+    async def _collect(self, key, queue):
+        loop = asyncio.get_running_loop()
+        first = self._carried.pop(key, None) or await queue.get()
+        batch = [first]
+        rows = len(first.inputs)
+        deadline = loop.time() + self.window_ms / 1000
+
+        # Keep adding requests until the window closes or the batch is full
+        while rows < self.max_batch_size:
+            if queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                pending = queue.get_nowait()
+            if rows + len(pending.inputs) > self.max_batch_size:
+                self._carried[key] = pending
+                break
+            batch.append(pending)
+            rows += len(pending.inputs)
+        return batch
+
+    async def _worker(self, key):
+        loop = asyncio.get_running_loop()
+        queue = self._queues[key]
+        while True:
+            batch = await self._collect(key, queue)
+            # Drop requests whose handlers have already gone away
+            batch = [pending for pending in batch if not pending.future.done()]
+            if not batch:
+                continue
+            self.stats.record_batch(sum(len(pending.inputs) for pending in batch))
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.run_batch, key, [pending.inputs for pending in batch]
+                )
+            except Exception as e:
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+                continue
+            for pending, result in zip(batch, results):
+                if not pending.future.done():
+                    pending.future.set_result(result)
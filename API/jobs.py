@@ -0,0 +1,283 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger("vasthra-jobs")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED_STATES = (DONE, FAILED)
+
+# How often an events stream re-reads a job that another process may be running
+EVENTS_POLL_S = 1.0
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the job queue is full."""
+
+class Job:
+    def __init__(self, params, job_id=None, status=QUEUED, result=None, error=None,
+                 created_at=None, updated_at=None, owner=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.params = params
+        self.status = status
+        self.result = result
+        self.error = error
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+        self.owner = owner
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+class MemoryJobStore:
+    """Keeps jobs in memory, forgetting the oldest finished jobs beyond max_jobs."""
+
+    def __init__(self, max_jobs=1000):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+
+    def save(self, job):
+        self._jobs[job.id] = job
+        if len(self._jobs) > self.max_jobs:
+            for job_id in [j.id for j in self._jobs.values() if j.status in FINISHED_STATES]:
+                del self._jobs[job_id]
+                if len(self._jobs) <= self.max_jobs:
+                    break
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def claim(self, job, owner):
+        """Mark a queued job as running; False if it is no longer queued."""
+        if job.status != QUEUED:
+            return False
+        job.status, job.owner, job.updated_at = RUNNING, owner, time.time()
+        return True
+
+    def unfinished(self):
+        jobs = [job for job in self._jobs.values() if job.status not in FINISHED_STATES]
+        for job in jobs:
+            job.status = QUEUED
+        return jobs
+
+    def close(self):
+        pass
+
+def owner_id():
+    """Identify this process as the owner of the jobs it runs."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _owner_alive(owner):
+    """False only for an owner on this host whose process has exited."""
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        pass
+    return True
+
+class SQLiteJobStore:
+    """Job store backed by SQLite, shared by every worker process and kept across restarts.
+
+    The database is the source of truth: reads always go to it, and a job only
+    runs in the process whose ``claim`` wins.
+    """
+
+    _COLUMNS = "id, params, status, result, error, created_at, updated_at, owner"
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        with self._db_lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, params TEXT, status TEXT, "
+                "result TEXT, error TEXT, created_at REAL, updated_at REAL, owner TEXT)"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+            if "owner" not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+    @staticmethod
+    def _job(row):
+        return Job(json.loads(row[1]), job_id=row[0], status=row[2],
+                   result=json.loads(row[3]) if row[3] else None, error=row[4],
+                   created_at=row[5], updated_at=row[6], owner=row[7])
+
+    def save(self, job):
+        with self._db_lock, self._db:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO jobs ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, json.dumps(job.params), job.status,
+                 json.dumps(job.result) if job.result is not None else None,
+                 job.error, job.created_at, job.updated_at, job.owner)
+            )
+
+    def claim(self, job, owner):
+        """Atomically mark a queued job as running for owner; False if another process got it first."""
+        now = time.time()
+        with self._db_lock, self._db:
+            claimed = self._db.execute(
+                "UPDATE jobs SET status = ?, owner = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (RUNNING, owner, now, job.id, QUEUED)
+            ).rowcount == 1
+        if claimed:
+            job.status, job.owner, job.updated_at = RUNNING, owner, now
+        return claimed
+
+    def get(self, job_id):
+        with self._db_lock:
+            row = self._db.execute(f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row is not None else None
+
+    def unfinished(self):
+        """Queued jobs, after requeueing running jobs whose owner process has died."""
+        with self._db_lock, self._db:
+            running = self._db.execute(
+                "SELECT id, owner FROM jobs WHERE status = ?", (RUNNING,)
+            ).fetchall()
+            for job_id, owner in running:
+                if owner is None or not _owner_alive(owner):
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, owner = NULL WHERE id = ? AND status = ? AND owner IS ?",
+                        (QUEUED, job_id, RUNNING, owner)
+                    )
+            rows = self._db.execute(
+                f"SELECT {self._COLUMNS} FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,)
+            ).fetchall()
+        return [self._job(row) for row in rows]
+
+    def close(self):
+        with self._db_lock:
+            self._db.close()
+
+class JobManager:
+    """Runs submitted jobs from a bounded queue and notifies status subscribers.
+
+    ``handler(params)`` is a coroutine function returning a JSON-serialisable result.
+    With a shared SQLiteJobStore several processes may queue the same job (every one
+    resumes unfinished jobs at startup); the store's atomic claim lets only one run it.
+    """
+
+    def __init__(self, handler, store=None, max_queued=100, num_workers=2):
+        self.handler = handler
+        self.store = store or MemoryJobStore()
+        self.max_queued = max_queued
+        self.num_workers = num_workers
+        self._queue = None
+        self._workers = []
+        self._subscribers = {}
+        self.owner = owner_id()
+
+    async def start(self):
+        unfinished = self.store.unfinished()
+        self._queue = asyncio.Queue(maxsize=max(self.max_queued, len(unfinished)))
+        for job in unfinished:
+            logger.info(f"Resuming job {job.id}")
+            self._queue.put_nowait(job)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self.store.close()
+
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit(self, params):
+        """Queue a new job and return it, or raise QueueFullError."""
+        if self._queue.full():
+            raise QueueFullError(f"{self._queue.qsize()} jobs already queued")
+        job = Job(params)
+        self.store.save(job)
+        self._queue.put_nowait(job)
+        return job
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    async def events(self, job_id):
+        """Yield the job's state every time it changes until it finishes.
+
+        Changes made in this process arrive immediately; the store is re-read every
+        EVENTS_POLL_S seconds for jobs running in another process.
+        """
+        job = self.store.get(job_id)
+        if job is None:
+            return
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(queue)
+        try:
+            # Track snapshots, not the Job: the worker updates that object while this generator is paused
+            state = job.to_dict()
+            yield state
+            while state["status"] not in FINISHED_STATES:
+                try:
+                    latest = await asyncio.wait_for(queue.get(), EVENTS_POLL_S)
+                except asyncio.TimeoutError:
+                    job = self.store.get(job_id)
+                    if job is None:
+                        continue
+                    latest = job.to_dict()
+                # Skip repeats, and notifications older than a state already read from the store
+                if (latest["status"], latest["updated_at"]) == (state["status"], state["updated_at"]) or \
+                        latest["updated_at"] < state["updated_at"]:
+                    continue
+                state = latest
+                yield state
+        finally:
+            self._subscribers[job_id].remove(queue)
+            if not self._subscribers[job_id]:
+                del self._subscribers[job_id]
+
+    def _update(self, job, status, result=None, error=None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.updated_at = time.time()
+        self.store.save(job)
+        self._notify(job)
+
+    def _notify(self, job):
+        for queue in self._subscribers.get(job.id, []):
+            queue.put_nowait(job.to_dict())
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            if not self.store.claim(job, self.owner):
+                # Another process (or an earlier copy in this queue) is running it
+                continue
+            self._notify(job)
+            try:
+                result = await self.handler(job.params)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+                self._update(job, FAILED, error=str(e))
+            else:
+                self._update(job, DONE, result=result)
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "Model_1"))
+from benchmark_utils import SAMPLE_DIR, sample_sketch_paths
+
+def multipart_body(fields, filename, data):
+    """Encode form fields and one file as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n".encode() + data + b"\r\n"
+    )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+def send_request(url, fields, filename, data, timeout):
+    """POST one sketch and return (latency_ms, status_code, served_from_cache)."""
+    body, content_type = multipart_body(fields, filename, data)
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    start = time.perf_counter()
+    cached = False
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            payload = response.read()
+            status = response.status
+            if response.headers.get_content_type() == "application/json":
+                cached = bool(json.loads(payload).get("cached"))
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, TimeoutError):
+        status = 0
+    return (time.perf_counter() - start) * 1000, status, cached
+
+def run_load_test(url, sketches, fields, concurrency, total_requests, timeout, first_seed):
+    """Drive the endpoint with `concurrency` clients until total_requests have completed.
+
+    Request i uses seed first_seed + i, so no request repeats another's cache key.
+    """
+    jobs = [({**fields, "seed": str(first_seed + i)}, *sketches[i % len(sketches)]) for i in range(total_requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        results = list(clients.map(lambda job: send_request(url, *job, timeout), jobs))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for latency, status, _ in results if status == 200])
+    cached = sum(1 for _, status, hit in results if status == 200 and hit)
+    statuses = {}
+    for _, status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "succeeded": int(len(latencies)),
+        "cached": cached,
+        "cached_ratio": cached / len(latencies) if len(latencies) else None,
+        "status_counts": statuses,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "latency_ms_p50": float(np.percentile(latencies, 50)) if len(latencies) else None,
+        "latency_ms_p95": float(np.percentile(latencies, 95)) if len(latencies) else None,
+        "latency_ms_p99": float(np.percentile(latencies, 99)) if len(latencies) else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the /generate/ endpoint of a running API.")
+    parser.add_argument("--url", type=str, default="http://localhost:8000/generate/", help="Endpoint to drive.")
+    parser.add_argument("--sketch_dir", type=str, default=SAMPLE_DIR, help="Directory of sketches to upload.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8],
+                        help="Concurrent clients; several values run one test each. Default is 1 4 8.")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per concurrency level. Default is 32.")
+    parser.add_argument("--generator", type=str, default="Generator 1", help="Generator form field.")
+    parser.add_argument("--ensemble", type=str, default="true", help="Ensemble form field. Default is true.")
+    parser.add_argument("--timeout", type=float, default=300, help="Per-request timeout in seconds.")
+    parser.add_argument("--output", type=str, default="load_test.json", help="JSON results file.")
+    args = parser.parse_args()
+
+    paths = sample_sketch_paths(args.sketch_dir)
+    sketches = []
+    for path in paths:
+        with open(path, "rb") as f:
+            sketches.append((os.path.basename(path), f.read()))
+
+    # A distinct seed per request keeps the result cache from answering instead of the model
+    fields = {"generator": args.generator, "ensemble": args.ensemble}
+    first_seed = int(time.time()) * 1000
+    runs = []
+    for concurrency in args.concurrency:
+        result = run_load_test(args.url, sketches, fields, concurrency, args.requests, args.timeout, first_seed)
+        runs.append(result)
+        print(f"concurrency {concurrency:>3}: {result['throughput_rps']:.2f} req/s, "
+              f"p50 {result['latency_ms_p50']} ms, p95 {result['latency_ms_p95']} ms, "
+              f"p99 {result['latency_ms_p99']} ms, {result['cached']} cached, statuses {result['status_counts']}")
+        first_seed += args.requests
+
+    with open(args.output, "w") as f:
+        json.dump({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "url": args.url, "runs": runs}, f, indent=2)
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, REGISTRY
+)
+
+# Seconds; covers cheap stages (ms) up to slow CPU ensembles (tens of seconds)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "vasthra_stage_seconds", "Time spent in each stage of a generation request",
+    ["stage", "generator", "ensemble"], buckets=STAGE_BUCKETS,
+)
+REQUESTS = Counter(
+    "vasthra_requests_total", "Generation requests by outcome",
+    ["endpoint", "generator", "ensemble", "outcome"],
+)
+BATCH_SIZE = Histogram(
+    "vasthra_batch_rows", "Rows per batched forward pass", ["generator"], buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32),
+)
+QUEUE_DEPTH = Gauge("vasthra_queue_depth", "Items waiting in each queue", ["queue"], multiprocess_mode="livesum")
+RESIDENT_MODELS = Gauge("vasthra_resident_models", "Generators held in memory", multiprocess_mode="livesum")
+DEVICE = Gauge("vasthra_device_info", "Device used for inference", ["device"], multiprocess_mode="max")
+
+def labels(options):
+    return str(options["generator_num"]), str(bool(options["ensemble"])).lower()
+
+@contextmanager
+def stage_timer(stage, options):
+    """Observe how long the enclosed block takes as the given stage of a request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage, *labels(options)).observe(time.perf_counter() - start)
+
+def observe_stage(stage, generator_num, ensemble, seconds):
+    STAGE_SECONDS.labels(stage, str(generator_num), str(bool(ensemble)).lower()).observe(seconds)
+
+def count_request(endpoint, options, outcome):
+    REQUESTS.labels(endpoint, *labels(options), outcome).inc()
+
+def render_metrics():
+    """Return (body, content type) for the /metrics endpoint.
+
+    With several uvicorn workers set PROMETHEUS_MULTIPROC_DIR so the metrics of all
+    worker processes are aggregated.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from storage import shard_relpath
+
+logger = logging.getLogger("vasthra-cache")
+
+# Results stored by the cache are named after their key so the index can be rebuilt from disk
+GENERATED_PATTERN = re.compile(r"^generated_image_([0-9a-f]{64})(\.png|\.webp|\.jpg)$")
+
+def cache_key(data, generator_num, enhance_sketch, ensemble, seed, variant=None, precision="fp32",
+              tile_size=None, tile_overlap=64, output_format="png"):
+    """Hash the uploaded bytes together with every parameter that changes the result."""
+    digest = hashlib.sha256(data)
+    params = {"generator_num": generator_num, "enhance_sketch": enhance_sketch, "ensemble": ensemble, "seed": seed}
+    # Exported variants and reduced precisions produce slightly different pixels, so they get their own entries
+    if variant is not None:
+        params["variant"] = variant
+    if precision != "fp32":
+        params["precision"] = precision
+    if tile_size is not None:
+        params["tile_size"] = tile_size
+        params["tile_overlap"] = tile_overlap
+    # Each stored format is its own file, so it is its own entry
+    if output_format != "png":
+        params["output_format"] = output_format
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+class _CacheEntry:
+    def __init__(self, generated_filename, sketch_filename, size_bytes):
+        self.generated_filename = generated_filename
+        self.sketch_filename = sketch_filename
+        self.size_bytes = size_bytes
+
+class ResultCache:
+    """Size-bounded, content-addressed index of generated results in output_dir.
+
+    Entries are evicted least-recently-used first (deleting their files and
+    thumbnails) once their total size exceeds ``max_bytes``. Results live in the
+    key's shard of output_dir. With a ``storage`` for that directory, its shared
+    SQLite index is the cache index, so every uvicorn worker sees the results of
+    the others and they share one ``max_bytes`` budget; otherwise the index is
+    kept in this process.
+    """
+
+    def __init__(self, output_dir, max_bytes=1024 * 2**20, storage=None):
+        self.output_dir = output_dir
+        self.max_bytes = max_bytes
+        self.storage = storage
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def filenames(key, ext=".png"):
+        """Return the generated image and input sketch paths for key, relative to output_dir."""
+        return shard_relpath(f"generated_image_{key}{ext}", key), shard_relpath(f"input_sketch_{key}.png", key)
+
+    def rebuild(self):
+        """Rebuild the in-process index from the cached results already in output_dir.
+
+        With a ``storage`` there is nothing to rebuild; results beyond the budget are evicted.
+        """
+        with self._lock:
+            if self.storage is not None:
+                self._evict_shared()
+                stats = self._shared_stats()
+                logger.info(f"Result cache uses the storage index: {stats['entries']} entries, "
+                            f"{stats['size_mb']:.1f} MB")
+                return
+        entries = self._entries_from_disk()
+
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+            # Oldest first so the least recently written results are evicted first
+            for _, key, ext, size_bytes in sorted(entries):
+                self._add(key, ext, size_bytes)
+            self._evict_over_budget()
+            logger.info(f"Result cache index rebuilt: {len(self._entries)} entries, {self._size_bytes / 2**20:.1f} MB")
+
+    def _entries_from_storage(self):
+        """Return (used_at, key, ext, size_bytes) for every complete result in the storage index."""
+        generated = self.storage.find("%/generated_image_%")
+        sketches = self.storage.find("%/input_sketch_%")
+        entries = []
+        for relpath, (size, _, used_at) in generated.items():
+            match = GENERATED_PATTERN.match(relpath.rsplit("/", 1)[-1])
+            if not match:
+                continue
+            key, ext = match.groups()
+            generated_filename, sketch_filename = self.filenames(key, ext)
+            if relpath == generated_filename and sketch_filename in sketches:
+                entries.append((used_at, key, ext, size + sketches[sketch_filename][0]))
+        return entries
+
+    def _entries_from_disk(self):
+        """Return (mtime, key, ext, size_bytes) for every complete result found by walking output_dir."""
+        found = []
+        for dirpath, _, names in os.walk(self.output_dir):
+            for name in names:
+                match = GENERATED_PATTERN.match(name)
+                if match:
+                    found.append(match.groups())
+        entries = []
+        for key, ext in found:
+            generated_filename, sketch_filename = self.filenames(key, ext)
+            try:
+                generated_stat = os.stat(os.path.join(self.output_dir, generated_filename))
+                sketch_stat = os.stat(os.path.join(self.output_dir, sketch_filename))
+            except FileNotFoundError:
+                continue
+            entries.append((generated_stat.st_mtime, key, ext, generated_stat.st_size + sketch_stat.st_size))
+        return entries
+
+    def get(self, key):
+        """Return (generated_filename, sketch_filename) for a cached result, or None."""
+        if self.storage is not None:
+            cached = self._get_shared(key)
+            with self._lock:
+                if cached is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            return cached
+
+        with self._lock:
+            entry = self._entries.get(key)
+            # The files may have been deleted behind the index's back, e.g. the storage sweeper
+            # removing a result's sketch but not yet its image
+            if entry is not None and not self._files_exist(entry.generated_filename, entry.sketch_filename):
+                del self._entries[key]
+                self._size_bytes -= entry.size_bytes
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.generated_filename, entry.sketch_filename
+
+    def _get_shared(self, key):
+        """Look key up in the storage index, marking it used; results from any worker process count."""
+        rows = self.storage.find(f"%_{key}.%")
+        generated_filename = next((path for path in rows if GENERATED_PATTERN.match(path.rsplit("/", 1)[-1])), None)
+        sketch_filename = self.filenames(key)[1]
+        if generated_filename is None or sketch_filename not in rows:
+            return None
+        if not self._files_exist(generated_filename, sketch_filename):
+            return None
+        self.storage.touch(generated_filename)
+        return generated_filename, sketch_filename
+
+    def _files_exist(self, *names):
+        return all(os.path.exists(os.path.join(self.output_dir, name)) for name in names)
+
+    def add(self, key, ext=".png"):
+        """Record a result that has been written to output_dir under the key's filenames.
+
+        With a ``storage``, the files must already have been added to it.
+        """
+        if self.storage is not None:
+            with self._lock:
+                self._evict_shared()
+            return
+
+        generated_filename, sketch_filename = self.filenames(key, ext)
+        size_bytes = sum(os.path.getsize(os.path.join(self.output_dir, name))
+                         for name in (generated_filename, sketch_filename))
+        with self._lock:
+            self._add(key, ext, size_bytes)
+            self._evict_over_budget()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            usage = self._shared_stats() if self.storage is not None else {
+                "entries": len(self._entries),
+                "size_mb": self._size_bytes / 2**20,
+            }
+            return {
+                **usage,
+                "max_mb": self.max_bytes / 2**20,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+    def _shared_stats(self):
+        entries = self._entries_from_storage()
+        return {"entries": len(entries), "size_mb": sum(entry[3] for entry in entries) / 2**20}
+
+    def _add(self, key, ext, size_bytes):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size_bytes -= old.size_bytes
+        self._entries[key] = _CacheEntry(*self.filenames(key, ext), size_bytes)
+        self._size_bytes += size_bytes
+
+    def _evict_over_budget(self):
+        while self._entries and self._size_bytes > self.max_bytes:
+            key, entry = self._entries.popitem(last=False)
+            self._size_bytes -= entry.size_bytes
+            for name in (entry.generated_filename, entry.sketch_filename, *self._thumbnails(key)):
+                try:
+                    os.remove(os.path.join(self.output_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def _evict_shared(self):
+        """Evict the least recently used results in the storage index until they fit the budget."""
+        entries = sorted(self._entries_from_storage())
+        size_bytes = sum(entry[3] for entry in entries)
+        for _, key, ext, entry_bytes in entries:
+            if size_bytes <= self.max_bytes:
+                break
+            # Another worker may be evicting the same result; removing a missing file is harmless
+            for name in (*self.filenames(key, ext), *self._thumbnails(key)):
+                self.storage.remove(name)
+            size_bytes -= entry_bytes
+
+    def _thumbnails(self, key):
+        """Return the thumbnails made for key in any format, relative to output_dir."""
+        if self.storage is not None:
+            return list(self.storage.find(f"%/thumbnail_{key}.%"))
+        shard = os.path.dirname(shard_relpath("", key))
+        try:
+            names = os.listdir(os.path.join(self.output_dir, shard))
+        except FileNotFoundError:
+            return []
+        return [f"{shard}/{name}" for name in names if name.startswith(f"thumbnail_{key}.")]
@@ -0,0 +1,194 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("vasthra-storage")
+
+# Default index of the files under a storage root, kept next to them
+INDEX_FILENAME = ".index.sqlite"
+
+def shard_relpath(name, digest=None):
+    """Return the path of name relative to its storage root, two hashed directory levels deep.
+
+    Files are spread by ``digest`` (a hex string) when given, otherwise by the hash of the name,
+    so no directory grows beyond a few thousand entries.
+    """
+    digest = digest or hashlib.sha256(name.encode()).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}/{name}"
+
+class Storage:
+    """Sharded directory of files with an index, a time-to-live and a size quota.
+
+    Files are added with ``path_for`` then ``add``. ``sweep`` deletes files older
+    than ``ttl_s`` and then the oldest files until the total is within
+    ``max_bytes``; either limit is disabled when falsy. The index is SQLite so
+    several uvicorn workers can share one root; keep ``index_path`` outside the
+    root when the root is served statically. ``touch`` records when a file was
+    last used, for callers that evict by recency.
+    """
+
+    def __init__(self, root, ttl_s=None, max_bytes=None, index_path=None):
+        self.root = root
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self.index_path = index_path or os.path.join(root, INDEX_FILENAME)
+        os.makedirs(root, exist_ok=True)
+        self._db = sqlite3.connect(self.index_path, timeout=30, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        self._sweeper = None
+        self._stop = threading.Event()
+        with self._db_lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, created_at REAL, used_at REAL)"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(files)")]
+            if "used_at" not in columns:
+                self._db.execute("ALTER TABLE files ADD COLUMN used_at REAL")
+                self._db.execute("UPDATE files SET used_at = created_at")
+            self._db.execute("CREATE INDEX IF NOT EXISTS files_created_at ON files (created_at)")
+
+    def path_for(self, name, digest=None):
+        """Return (relpath, absolute path) for a new file, creating its shard directory."""
+        relpath = shard_relpath(name, digest)
+        path = os.path.join(self.root, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return relpath, path
+
+    def shard_dir(self, digest):
+        """Return the absolute shard directory for a hex digest, creating it."""
+        path = os.path.dirname(os.path.join(self.root, shard_relpath("", digest)))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def abspath(self, relpath):
+        return os.path.join(self.root, relpath)
+
+    def relpath(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def add(self, relpath):
+        """Record a file that has been written under the root."""
+        stat = os.stat(self.abspath(relpath))
+        with self._db_lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                             (relpath, stat.st_size, stat.st_mtime, stat.st_mtime))
+
+    def touch(self, relpath, now=None):
+        """Record that a file was just used; its age for the TTL still counts from when it was added."""
+        with self._db_lock, self._db:
+            self._db.execute("UPDATE files SET used_at = ? WHERE path = ?", (now or time.time(), relpath))
+
+    def remove(self, relpath):
+        """Delete a file and forget it."""
+        try:
+            os.remove(self.abspath(relpath))
+        except FileNotFoundError:
+            pass
+        with self._db_lock, self._db:
+            self._db.execute("DELETE FROM files WHERE path = ?", (relpath,))
+
+    def list(self, offset=0, limit=100):
+        """Return one page of files, newest first, and the total number of files."""
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT path, size, created_at FROM files ORDER BY created_at DESC LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+            total = self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        files = [{"path": path, "size": size, "created_at": created_at} for path, size, created_at in rows]
+        return {"total": total, "offset": offset, "limit": limit, "files": files}
+
+    def find(self, pattern):
+        """Return {relpath: (size, created_at, used_at)} for indexed files whose path matches a SQL LIKE pattern."""
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT path, size, created_at, used_at FROM files WHERE path LIKE ?", (pattern,)
+            ).fetchall()
+        return {path: (size, created_at, used_at) for path, size, created_at, used_at in rows}
+
+    def usage(self):
+        with self._db_lock:
+            count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files").fetchone()
+        return {
+            "files": count,
+            "size_mb": size / 2**20,
+            "max_mb": self.max_bytes / 2**20 if self.max_bytes else None,
+            "ttl_s": self.ttl_s,
+        }
+
+    def rebuild(self):
+        """Re-index every file under the root, including files from before it was sharded."""
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if path.startswith(self.index_path) or name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((self.relpath(path), stat.st_size, stat.st_mtime, stat.st_mtime))
+        with self._db_lock, self._db:
+            self._db.execute("DELETE FROM files")
+            self._db.executemany("INSERT INTO files VALUES (?, ?, ?, ?)", found)
+        logger.info(f"Storage index of {self.root} rebuilt: {len(found)} files")
+
+    def rebuild_if_empty(self):
+        with self._db_lock:
+            empty = self._db.execute("SELECT 1 FROM files LIMIT 1").fetchone() is None
+        if empty:
+            self.rebuild()
+
+    def sweep(self, now=None):
+        """Delete expired files, then the oldest files until within the quota. Returns the number deleted."""
+        now = now or time.time()
+        expired = []
+        if self.ttl_s:
+            with self._db_lock:
+                expired = [row[0] for row in self._db.execute(
+                    "SELECT path FROM files WHERE created_at < ?", (now - self.ttl_s,)
+                )]
+        for relpath in expired:
+            self.remove(relpath)
+
+        over_quota = []
+        if self.max_bytes:
+            with self._db_lock:
+                total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+                if total > self.max_bytes:
+                    for relpath, size in self._db.execute("SELECT path, size FROM files ORDER BY created_at"):
+                        over_quota.append(relpath)
+                        total -= size
+                        if total <= self.max_bytes:
+                            break
+        for relpath in over_quota:
+            self.remove(relpath)
+
+        if expired or over_quota:
+            logger.info(f"Swept {self.root}: {len(expired)} expired, {len(over_quota)} over quota")
+        return len(expired) + len(over_quota)
+
+    def start_sweeper(self, interval_s):
+        """Sweep every interval_s seconds on a background thread."""
+        def run():
+            while not self._stop.wait(interval_s):
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.error(f"Sweeping {self.root} failed: {e}", exc_info=True)
+
+        self._stop.clear()
+        self._sweeper = threading.Thread(target=run, name="storage-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def close(self):
+        self._stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+        with self._db_lock:
+            self._db.close()
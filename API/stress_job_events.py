@@ -0,0 +1,63 @@
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+from jobs import DONE, JobManager, MemoryJobStore, SQLiteJobStore
+
+async def check_events(store, jobs, handler_ms, consumer_ms):
+    """Stream every job's events with a consumer slower than the handler; return the errors found."""
+    async def handler(params):
+        await asyncio.sleep(handler_ms / 1000)
+        return {"value": params["value"]}
+
+    async def consume(job_id):
+        states = []
+        async for state in manager.events(job_id):
+            states.append(state)
+            await asyncio.sleep(consumer_ms / 1000)
+        return states
+
+    manager = JobManager(handler, store=store, max_queued=jobs, num_workers=2)
+    await manager.start()
+    try:
+        submitted = [manager.submit({"value": i}) for i in range(jobs)]
+        streams = await asyncio.gather(*(consume(job.id) for job in submitted))
+    finally:
+        await manager.stop()
+
+    errors = []
+    for i, (job, states) in enumerate(zip(submitted, streams)):
+        statuses = [state["status"] for state in states]
+        if not states or states[-1]["status"] != DONE:
+            errors.append(f"job {job.id} stream ended with {statuses} instead of {DONE}")
+        elif states[-1]["result"] != {"value": i}:
+            errors.append(f"job {job.id} stream ended with result {states[-1]['result']}")
+        if len(set(statuses)) != len(statuses):
+            errors.append(f"job {job.id} stream repeated a status: {statuses}")
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Check job event streams report every job's final state.")
+    parser.add_argument("--jobs", type=int, default=20, help="Jobs to submit per store.")
+    parser.add_argument("--handler_ms", type=float, default=10, help="Time each job takes, like a cache hit.")
+    parser.add_argument("--consumer_ms", type=float, default=50, help="Time the client spends on each event.")
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix="stress_job_events_")
+    try:
+        errors = []
+        for name, store in (("memory", MemoryJobStore()), ("sqlite", SQLiteJobStore(os.path.join(db_dir, "jobs.sqlite")))):
+            errors += [f"{name}: {error}" for error in
+                       asyncio.run(check_events(store, args.jobs, args.handler_ms, args.consumer_ms))]
+    finally:
+        shutil.rmtree(db_dir)
+
+    for error in errors:
+        print(f"FAIL: {error}")
+    if errors:
+        raise SystemExit(1)
+    print(f"OK: every event stream of {args.jobs} jobs per store ended with {DONE} and the job's result")
+
+if __name__ == "__main__":
+    main()
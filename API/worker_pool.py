@@ -0,0 +1,41 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+class PoolFullError(Exception):
+    """Raised when a request arrives while the pool already has max_pending requests."""
+
+class WorkerPool:
+    """Bounded thread pool that keeps CPU-heavy request work off the event loop.
+
+    At most ``max_pending`` requests are admitted at once; callers should reject
+    anything beyond that (e.g. with a 503) instead of letting work pile up.
+    """
+
+    def __init__(self, max_workers=4, max_pending=16, timeout_s=120):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout_s = timeout_s
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vasthra-worker")
+        self._in_flight = 0
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def acquire(self):
+        """Admit one request or raise PoolFullError. Only call from the event loop."""
+        if self._in_flight >= self.max_pending:
+            raise PoolFullError(f"{self._in_flight} requests already in progress")
+        self._in_flight += 1
+
+    def release(self):
+        self._in_flight -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a blocking function on the pool and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,145 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+from model_registry import registry, device, VARIANTS
+from generate_image import (
+    PRECISIONS, load_sketch, sketches_to_tensor, prepare_generator_input, run_batched_forward, precision_context,
+    model_variant, tensor_to_image, write_atomic
+)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp")
+
+class SketchFileDataset(Dataset):
+    """Decodes and preprocesses sketches in DataLoader workers."""
+
+    def __init__(self, paths, enhance_sketch=True):
+        self.paths = paths
+        self.enhance_sketch = enhance_sketch
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, idx):
+        sketch = load_sketch(self.paths[idx], self.enhance_sketch)
+        return idx, sketches_to_tensor([sketch])[0]
+
+def list_sketches(input_dir=None, manifest=None):
+    """Return sketch paths from a directory or a manifest file with one path per line."""
+    if manifest:
+        base_dir = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest) as f:
+            lines = [line.strip() for line in f]
+        return [line if os.path.isabs(line) else os.path.join(base_dir, line) for line in lines if line]
+    return sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+def output_paths_for(paths, output_dir):
+    """Map sketch paths to output paths, mirroring their directories below the common parent.
+
+    Raises ValueError when two sketches would share an output, e.g. ``a.png`` and ``a.jpg``.
+    """
+    if not paths:
+        return []
+    base_dir = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    output_paths = [
+        os.path.join(output_dir, f"{os.path.splitext(os.path.relpath(os.path.abspath(path), base_dir))[0]}.png")
+        for path in paths
+    ]
+    first = {}
+    for path, output_path in zip(paths, output_paths):
+        if output_path in first:
+            raise ValueError(f"{first[output_path]} and {path} would both be written to {output_path}")
+        first[output_path] = path
+    return output_paths
+
+def write_image(image, output_path):
+    """Write atomically, so an interrupted run never leaves a partial output."""
+    write_atomic(output_path, Image.fromarray(image))
+
+def batch_generate(paths, output_dir, generator_num=1, batch_size=8, num_workers=4, writer_threads=4,
+                   enhance_sketch=True, ensemble=True, ensemble_samples=3, noise_std=0.02, seed=None,
+                   variant=None, precision="fp32"):
+    """Generate an image for every sketch path that has no output yet; return (generated, skipped)."""
+    output_paths = output_paths_for(paths, output_dir)
+
+    # Resume: skip sketches whose output already exists. Noise seeds follow a sketch's position
+    # in the full list, so a resumed run or another batch size reproduces the same images.
+    todo = [i for i, output_path in enumerate(output_paths) if not os.path.exists(output_path)]
+    skipped = len(paths) - len(todo)
+    if not todo:
+        return 0, skipped
+
+    generator = registry.get(generator_num, model_variant(variant, precision))
+    loader = DataLoader(
+        SketchFileDataset([paths[i] for i in todo], enhance_sketch),
+        batch_size=batch_size,
+        num_workers=num_workers,
+        pin_memory=device.type == "cuda",
+        prefetch_factor=2 if num_workers > 0 else None,
+    )
+
+    with ThreadPoolExecutor(max_workers=writer_threads) as writers:
+        pending = []
+        for indices, sketch_tensors in loader:
+            indices = [todo[idx] for idx in indices.tolist()]
+            sketch_tensors = sketch_tensors.to(device, non_blocking=True)
+            if ensemble:
+                inputs = [
+                    prepare_generator_input(sketch_tensor.unsqueeze(0), True, ensemble_samples, noise_std,
+                                            None if seed is None else seed + idx)
+                    for idx, sketch_tensor in zip(indices, sketch_tensors)
+                ]
+                generated = torch.cat(run_batched_forward(generator, inputs, precision)).cpu()
+            else:
+                with torch.no_grad(), precision_context(precision):
+                    generated = generator(sketch_tensors).float().cpu()
+
+            # Encode and write on the writer pool while the next batch runs
+            for idx, image in zip(indices, generated):
+                os.makedirs(os.path.dirname(output_paths[idx]), exist_ok=True)
+                pending.append(writers.submit(write_image, tensor_to_image(image.unsqueeze(0)), output_paths[idx]))
+
+            # Keep the number of in-flight writes bounded
+            while len(pending) > writer_threads * batch_size:
+                pending.pop(0).result()
+        for future in pending:
+            future.result()
+    return len(todo), skipped
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate images for a whole directory or manifest of sketches.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input_dir", type=str, help="Directory of sketch images.")
+    source.add_argument("--manifest", type=str, help="Text file listing one sketch path per line.")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory for the generated images.")
+    parser.add_argument("--generator_num", type=int, default=1, choices=[1, 2, 3], help="Generator model to use.")
+    parser.add_argument("--batch_size", type=int, default=8, help="Sketches per forward pass. Default is 8.")
+    parser.add_argument("--num_workers", type=int, default=4, help="Decode/preprocess workers. Default is 4.")
+    parser.add_argument("--writer_threads", type=int, default=4, help="PNG encoding threads. Default is 4.")
+    parser.add_argument("--enhance", action="store_true", help="Apply sketch enhancement preprocessing.")
+    parser.add_argument("--ensemble", action="store_true", help="Use ensemble generation for better results.")
+    parser.add_argument("--ensemble_samples", type=int, default=3, help="Noisy copies per sketch. Default is 3.")
+    parser.add_argument("--noise_std", type=float, default=0.02, help="Ensemble noise sigma. Default is 0.02.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the ensemble noise.")
+    parser.add_argument("--variant", type=str, default=None, choices=VARIANTS, help="Exported generator artifact.")
+    parser.add_argument("--precision", type=str, default="fp32", choices=PRECISIONS, help="Inference precision.")
+    args = parser.parse_args()
+
+    paths = list_sketches(args.input_dir, args.manifest)
+    start = time.perf_counter()
+    generated, skipped = batch_generate(
+        paths, args.output_dir, args.generator_num, args.batch_size, args.num_workers, args.writer_threads,
+        args.enhance, args.ensemble, args.ensemble_samples, args.noise_std, args.seed, args.variant, args.precision
+    )
+    elapsed = time.perf_counter() - start
+    rate = generated / elapsed if elapsed > 0 else 0.0
+    print(f"Generated {generated} images ({skipped} already existed) in {elapsed:.1f} s: {rate:.2f} images/s")
+
+if __name__ == "__main__":
+    main()
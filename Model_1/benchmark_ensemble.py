@@ -0,0 +1,51 @@
+import argparse
+import time
+import torch
+from benchmark_utils import architectures
+from generate_image import ensemble_generate, ensemble_generate_loop
+
+def time_ensemble(fn, generator, sketch_tensor, num_samples, noise_std, repeats, warmup):
+    """Return the mean latency of an ensemble function in milliseconds."""
+    with torch.no_grad():
+        for _ in range(warmup):
+            fn(generator, sketch_tensor, num_samples, noise_std, seed=0)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn(generator, sketch_tensor, num_samples, noise_std, seed=0)
+        if sketch_tensor.is_cuda:
+            torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare looped and batched ensemble inference.")
+    parser.add_argument("--size", type=int, default=512, help="Sketch height and width. Default is 512.")
+    parser.add_argument("--samples", type=int, default=3, help="Ensemble size N. Default is 3.")
+    parser.add_argument("--noise_std", type=float, default=0.02, help="Ensemble noise sigma. Default is 0.02.")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed iterations per path. Default is 5.")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed warm-up iterations. Default is 1.")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+    sketch_tensor = torch.rand(1, 1, args.size, args.size, device=device) * 2 - 1
+
+    print(f"Device: {device}, input: {args.size}x{args.size}, N={args.samples}")
+    for name, Generator in architectures().items():
+        generator = Generator().to(device).eval()
+
+        # Both paths must agree when no noise is added
+        with torch.no_grad():
+            expected = ensemble_generate_loop(generator, sketch_tensor, args.samples, 0.0)
+            actual = ensemble_generate(generator, sketch_tensor, args.samples, 0.0)
+        max_diff = (expected - actual).abs().max().item()
+
+        loop_ms = time_ensemble(ensemble_generate_loop, generator, sketch_tensor,
+                                args.samples, args.noise_std, args.repeats, args.warmup)
+        batched_ms = time_ensemble(ensemble_generate, generator, sketch_tensor,
+                                   args.samples, args.noise_std, args.repeats, args.warmup)
+        print(f"{name}: loop {loop_ms:.1f} ms, batched {batched_ms:.1f} ms, "
+              f"speedup {loop_ms / batched_ms:.2f}x, max abs diff {max_diff:.2e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import argparse
+import json
+import platform
+import time
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from benchmark_utils import SAMPLE_DIR, architectures, sample_sketch_paths
+from generate_image import (
+    decode_sketch, preprocess_sketch, transform, sketches_to_tensor, ensemble_generate,
+    tensor_to_image, encode_image, make_thumbnail
+)
+
+def summarize(samples_ms):
+    samples = np.asarray(samples_ms)
+    return {
+        "runs": len(samples),
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "min_ms": float(samples.min()),
+    }
+
+def time_stage(fn, inputs, repeats):
+    """Time fn over every input, repeats times, after one warm-up pass."""
+    for item in inputs[:1]:
+        fn(item)
+    samples = []
+    for _ in range(repeats):
+        for item in inputs:
+            start = time.perf_counter()
+            fn(item)
+            samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+def run_benchmarks(paths, repeats=3, model_repeats=2, device="cpu"):
+    """Time every stage of generate_image separately and return the results."""
+    device = torch.device(device)
+    encoded = []
+    for path in paths:
+        with open(path, "rb") as f:
+            encoded.append(f.read())
+    decoded = [decode_sketch(data) for data in encoded]
+    sketches = [preprocess_sketch(image) for image in decoded]
+    outputs = []
+
+    results = {
+        "decode": time_stage(decode_sketch, encoded, repeats),
+        "preprocess_sketch": time_stage(preprocess_sketch, decoded, repeats),
+        "transform_pil": time_stage(lambda sketch: transform(Image.fromarray(sketch)), sketches, repeats),
+        "transform_vectorized": time_stage(lambda sketch: sketches_to_tensor([sketch]), sketches, repeats),
+    }
+
+    torch.manual_seed(0)
+    sketch_tensor = sketches_to_tensor(sketches[:1]).to(device)
+    for name, Generator in architectures().items():
+        generator = Generator().to(device).eval()
+        with torch.no_grad():
+            results[f"{name}/single"] = time_stage(generator, [sketch_tensor], model_repeats)
+            results[f"{name}/ensemble"] = time_stage(
+                lambda x: ensemble_generate(generator, x, seed=0), [sketch_tensor], model_repeats
+            )
+            outputs.append(tensor_to_image(generator(sketch_tensor).cpu()))
+
+    results["png_encode"] = time_stage(encode_image, outputs, repeats)
+    results["png_encode_level1"] = time_stage(lambda image: encode_image(image, compress_level=1), outputs, repeats)
+    results["webp_encode_q80"] = time_stage(lambda image: encode_image(image, "webp", quality=80), outputs, repeats)
+    results["jpeg_encode_q85"] = time_stage(lambda image: encode_image(image, "jpeg", quality=85), outputs, repeats)
+    results["thumbnail_256"] = time_stage(lambda image: encode_image(make_thumbnail(image), "webp", quality=80),
+                                          outputs, repeats)
+    return results
+
+def compare_to_baseline(results, baseline_path, threshold):
+    """Return the stages whose mean latency grew by more than threshold (a fraction) vs a previous run."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["stages"]
+    regressions = {}
+    for stage, stats in results.items():
+        if stage in baseline and stats["mean_ms"] > baseline[stage]["mean_ms"] * (1 + threshold):
+            regressions[stage] = {"baseline_ms": baseline[stage]["mean_ms"], "current_ms": stats["mean_ms"]}
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the generation pipeline.")
+    parser.add_argument("--sketch_dir", type=str, default=SAMPLE_DIR, help="Directory of sketches to use.")
+    parser.add_argument("--repeats", type=int, default=3, help="Passes over the sketches for cheap stages.")
+    parser.add_argument("--model_repeats", type=int, default=2, help="Timed runs per generator stage.")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--output", type=str, default="benchmark_pipeline.json", help="JSON results file.")
+    parser.add_argument("--baseline", type=str, default=None, help="Previous results file to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative slowdown reported as a regression. Default is 0.2 (20%%).")
+    args = parser.parse_args()
+
+    paths = sample_sketch_paths(args.sketch_dir)
+
+    results = run_benchmarks(paths, args.repeats, args.model_repeats, args.device)
+    for stage, stats in results.items():
+        print(f"{stage:>35}: mean {stats['mean_ms']:9.2f} ms  p95 {stats['p95_ms']:9.2f} ms")
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "opencv": cv2.__version__,
+            "device": args.device,
+            "threads": torch.get_num_threads(),
+        },
+        "stages": results,
+    }
+    if args.baseline:
+        report["regressions"] = compare_to_baseline(results, args.baseline, args.threshold)
+        for stage, regression in report["regressions"].items():
+            print(f"REGRESSION {stage}: {regression['baseline_ms']:.2f} ms -> {regression['current_ms']:.2f} ms")
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if report.get("regressions"):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import argparse
+import sys
+import time
+import torch
+from PIL import Image
+from benchmark_utils import SAMPLE_DIR, sample_sketch_paths
+from generate_image import preprocess_sketch, transform, sketches_to_tensor
+
+def reference_pipeline(sketches):
+    """The original per-image PIL path: convert each sketch to PIL, transform it and stack."""
+    return torch.stack([transform(Image.fromarray(sketch)) for sketch in sketches])
+
+def fast_pipeline(sketches, out=None):
+    return sketches_to_tensor(sketches, out=out)
+
+def time_per_image(fn, sketches, repeats, **kwargs):
+    """Return the mean preprocessing time per image in milliseconds."""
+    fn(sketches, **kwargs)  # Warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(sketches, **kwargs)
+    return (time.perf_counter() - start) / (repeats * len(sketches)) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark and check the vectorized sketch preprocessing.")
+    parser.add_argument("--sketch_dir", type=str, default=SAMPLE_DIR, help="Directory of sketches to use.")
+    parser.add_argument("--repeats", type=int, default=10, help="Timed iterations per path. Default is 10.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.02,
+        help="Maximum allowed mean absolute difference from the PIL pipeline. Default is 0.02."
+    )
+    args = parser.parse_args()
+
+    paths = sample_sketch_paths(args.sketch_dir)
+    sketches = [preprocess_sketch(path) for path in paths]
+
+    # Regression check: the fast path must match the PIL transform within tolerance
+    expected = reference_pipeline(sketches)
+    actual = fast_pipeline(sketches)
+    diff = (expected - actual).abs()
+    mean_diff, max_diff = diff.mean().item(), diff.max().item()
+    print(f"{len(sketches)} sketches, mean abs diff {mean_diff:.4f}, max abs diff {max_diff:.4f}")
+
+    reference_ms = time_per_image(reference_pipeline, sketches, args.repeats)
+    fast_ms = time_per_image(fast_pipeline, sketches, args.repeats)
+    out = torch.empty(len(sketches), 1, 512, 512)
+    fast_reused_ms = time_per_image(fast_pipeline, sketches, args.repeats, out=out)
+    print(f"PIL transform: {reference_ms:.2f} ms/image")
+    print(f"Vectorized: {fast_ms:.2f} ms/image ({reference_ms / fast_ms:.2f}x)")
+    print(f"Vectorized, reused output buffer: {fast_reused_ms:.2f} ms/image ({reference_ms / fast_reused_ms:.2f}x)")
+
+    if mean_diff > args.tolerance:
+        print(f"FAILED: mean abs diff {mean_diff:.4f} exceeds tolerance {args.tolerance}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import json
+import multiprocessing as mp
+import resource
+import time
+import cv2
+import numpy as np
+import torch
+from benchmark_utils import SAMPLE_DIR, sample_sketch_paths
+from model_registry import artifact_path
+from generate_image import (
+    PRECISIONS, precision_context, preprocess_sketch, sketches_to_tensor, ensemble_generate, tensor_to_image
+)
+
+def psnr(reference, image):
+    mse = np.mean((reference.astype(np.float64) - image.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+def ssim(reference, image):
+    """Mean SSIM over channels with the usual 11x11 Gaussian window (sigma 1.5)."""
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    scores = []
+    for channel in range(reference.shape[2]):
+        x = reference[..., channel].astype(np.float64)
+        y = image[..., channel].astype(np.float64)
+        mu_x = cv2.GaussianBlur(x, (11, 11), 1.5)
+        mu_y = cv2.GaussianBlur(y, (11, 11), 1.5)
+        sigma_x = cv2.GaussianBlur(x * x, (11, 11), 1.5) - mu_x ** 2
+        sigma_y = cv2.GaussianBlur(y * y, (11, 11), 1.5) - mu_y ** 2
+        sigma_xy = cv2.GaussianBlur(x * y, (11, 11), 1.5) - mu_x * mu_y
+        ssim_map = ((2 * mu_x * mu_y + c1) * (2 * sigma_xy + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (sigma_x + sigma_y + c2))
+        scores.append(ssim_map.mean())
+    return float(np.mean(scores))
+
+def run_precision(precision, generator_num, paths, repeats, results):
+    """Run in a fresh process so peak RSS reflects this precision alone."""
+    from export_generator import load_fp32_generator
+
+    if precision == "int8":
+        generator = torch.jit.load(artifact_path(generator_num, "int8"), map_location="cpu")
+    else:
+        generator = load_fp32_generator(generator_num)
+
+    sketch_tensors = [sketches_to_tensor([preprocess_sketch(path)]) for path in paths]
+    outputs = []
+    latencies = []
+    with torch.no_grad(), precision_context(precision):
+        for sketch_tensor in sketch_tensors:
+            ensemble_generate(generator, sketch_tensor, seed=0)  # Warm-up
+            start = time.perf_counter()
+            for _ in range(repeats):
+                generated = ensemble_generate(generator, sketch_tensor, seed=0)
+            latencies.append((time.perf_counter() - start) / repeats * 1000)
+            outputs.append(tensor_to_image(generated.float()))
+
+    results.put({
+        "precision": precision,
+        "latency_ms": float(np.mean(latencies)),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "outputs": outputs,
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fp32, bf16 and int8 generator inference.")
+    parser.add_argument("--generator_num", type=int, default=1, choices=[1, 2, 3], help="Generator model to test.")
+    parser.add_argument("--sketch_dir", type=str, default=SAMPLE_DIR, help="Directory of evaluation sketches.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed ensemble runs per sketch. Default is 3.")
+    parser.add_argument("--precisions", type=str, nargs="+", default=list(PRECISIONS), choices=PRECISIONS)
+    parser.add_argument("--output", type=str, default=None, help="Optional JSON file for the report.")
+    args = parser.parse_args()
+
+    paths = sample_sketch_paths(args.sketch_dir)
+
+    precisions = ["fp32"] + [p for p in args.precisions if p != "fp32"]
+    ctx = mp.get_context("spawn")
+    runs = {}
+    for precision in precisions:
+        results = ctx.Queue()
+        process = ctx.Process(target=run_precision, args=(precision, args.generator_num, paths, args.repeats, results))
+        process.start()
+        runs[precision] = results.get()
+        process.join()
+
+    reference = runs["fp32"]["outputs"]
+    report = []
+    for precision in precisions:
+        run = runs[precision]
+        row = {
+            "precision": precision,
+            "latency_ms": run["latency_ms"],
+            "peak_rss_mb": run["peak_rss_mb"],
+            "psnr_db": float(np.mean([psnr(r, o) for r, o in zip(reference, run["outputs"])])),
+            "ssim": float(np.mean([ssim(r, o) for r, o in zip(reference, run["outputs"])])),
+        }
+        report.append(row)
+        print(f"{precision:>5}: {row['latency_ms']:8.1f} ms  peak RSS {row['peak_rss_mb']:7.1f} MB  "
+              f"PSNR {row['psnr_db']:6.2f} dB  SSIM {row['ssim']:.4f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
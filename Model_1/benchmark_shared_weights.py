@@ -0,0 +1,102 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import resource
+import tempfile
+import time
+import torch
+from model_registry import MODEL_DIR, ModelRegistry, artifact_path, configure_threads, load_generator_module
+
+def memory_mb():
+    """Return this process's (RSS, PSS) in MB; PSS splits shared pages between the processes mapping them."""
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = dict(line.split(":", 1) for line in f if line.startswith(("Rss:", "Pss:")))
+        return int(fields["Rss"].split()[0]) / 1024, int(fields["Pss"].split()[0]) / 1024
+    except FileNotFoundError:
+        # Not Linux: peak RSS is the best available, and PSS is unknown
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, None
+
+def run_worker(model_dir, generator_num, shared_weights, num_threads, size, repeats, barrier, results):
+    """One serving process: load the generator, wait for the others, then time forward passes."""
+    configure_threads(num_threads)
+    registry = ModelRegistry(model_dir, torch.device("cpu"), shared_weights=shared_weights)
+    generator = registry.get(generator_num)
+    x = torch.randn(1, 1, size, size)
+    with torch.no_grad():
+        generator(x)  # Warm-up
+    barrier.wait()
+    # Measured while every process holds its generator, so shared pages are split between them
+    rss_mb, pss_mb = memory_mb()
+    start = time.perf_counter()
+    with torch.no_grad():
+        for _ in range(repeats):
+            generator(x)
+    finished = time.perf_counter()
+    barrier.wait()
+    results.put({"rss_mb": rss_mb, "pss_mb": pss_mb, "start": start, "finished": finished})
+
+def run_config(model_dir, generator_num, processes, shared_weights, num_threads, size, repeats):
+    """Run `processes` serving processes side by side and return their combined memory and throughput."""
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(processes)
+    results = ctx.Queue()
+    workers = [
+        ctx.Process(target=run_worker,
+                    args=(model_dir, generator_num, shared_weights, num_threads, size, repeats, barrier, results))
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    runs = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    elapsed = max(run["finished"] for run in runs) - min(run["start"] for run in runs)
+    pss = [run["pss_mb"] for run in runs]
+    return {
+        "weights": "shared" if shared_weights else "private",
+        "threads_per_process": num_threads or torch.get_num_threads(),
+        "processes": processes,
+        "total_rss_mb": sum(run["rss_mb"] for run in runs),
+        "total_pss_mb": sum(pss) if None not in pss else None,
+        "images_per_s": processes * repeats / elapsed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare memory and throughput of several serving processes with private or shared weights."
+    )
+    parser.add_argument("--generator_num", type=int, default=2, choices=[1, 2, 3], help="Generator model to load.")
+    parser.add_argument("--processes", type=int, default=4, help="Serving processes, like uvicorn workers.")
+    parser.add_argument("--size", type=int, default=512, help="Height and width of the dummy input.")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed forward passes per process.")
+    parser.add_argument("--output", type=str, default=None, help="Optional JSON file for the report.")
+    args = parser.parse_args()
+
+    model_dir = MODEL_DIR
+    if not os.path.exists(artifact_path(args.generator_num)):
+        # No trained weights here: random ones have the same size, which is all that matters for this comparison
+        model_dir = tempfile.mkdtemp(prefix="benchmark_shared_weights_")
+        torch.save(load_generator_module(args.generator_num)().state_dict(),
+                   artifact_path(args.generator_num, model_dir=model_dir))
+        print(f"No weights for generator {args.generator_num}; using random weights in {model_dir}")
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    pinned = max(1, cores // args.processes)
+    report = []
+    for shared_weights, num_threads in ((False, None), (False, pinned), (True, pinned)):
+        row = run_config(model_dir, args.generator_num, args.processes, shared_weights, num_threads,
+                         args.size, args.repeats)
+        report.append(row)
+        pss = f"{row['total_pss_mb']:8.1f} MB" if row["total_pss_mb"] is not None else "     n/a"
+        print(f"{row['weights']:>7} weights, {row['threads_per_process']:>3} threads x {row['processes']} processes: "
+              f"total RSS {row['total_rss_mb']:8.1f} MB  total PSS {pss}  {row['images_per_s']:6.2f} images/s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import glob
+import os
+
+# Sketches shipped with the project, used as realistic inputs
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Sample sketches")
+
+def sample_sketch_paths(sketch_dir=SAMPLE_DIR):
+    """Return the sorted .png and .jpg sketches in sketch_dir, raising FileNotFoundError if there are none."""
+    paths = sorted(glob.glob(os.path.join(sketch_dir, "*.png")) + glob.glob(os.path.join(sketch_dir, "*.jpg")))
+    if not paths:
+        raise FileNotFoundError(f"No sketches found in {sketch_dir}")
+    return paths
+
+def architectures():
+    """Generator architectures to compare, randomly initialized so no .pth files are needed.
+
+    Imported on call so scripts that only need the sample sketches don't load torch.
+    """
+    import sketch_to_image_gan
+    import sketch_to_image_gan_2
+    return {
+        "sketch_to_image_gan": sketch_to_image_gan.Generator,
+        "sketch_to_image_gan_2": sketch_to_image_gan_2.Generator,
+    }
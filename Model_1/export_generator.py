@@ -0,0 +1,84 @@
+import argparse
+import os
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from model_registry import MODEL_DIR, load_generator_module, artifact_path
+
+CONV_TYPES = (nn.Conv2d, nn.ConvTranspose2d)
+
+def _fuse(conv, bn):
+    return fuse_conv_bn_eval(conv, bn, transpose=isinstance(conv, nn.ConvTranspose2d))
+
+def fuse_conv_bn(module):
+    """Fold every BatchNorm2d into the convolution before it, in place.
+
+    Handles ``nn.Sequential(conv, bn, ...)`` stacks (``initial``, ``down1/2``, ``up1/2``)
+    and ``convN``/``bnN`` attribute pairs (``ResidualBlock`` and the second generator).
+    The module must be in eval mode; folded BatchNorms are replaced by ``nn.Identity``.
+    """
+    for name, child in module.named_children():
+        if isinstance(child, nn.Sequential):
+            for i in range(len(child) - 1):
+                if isinstance(child[i], CONV_TYPES) and isinstance(child[i + 1], nn.BatchNorm2d):
+                    child[i] = _fuse(child[i], child[i + 1])
+                    child[i + 1] = nn.Identity()
+        elif name.startswith("bn") and isinstance(child, nn.BatchNorm2d):
+            conv_name = "conv" + name[len("bn"):]
+            conv = getattr(module, conv_name, None)
+            if isinstance(conv, CONV_TYPES):
+                setattr(module, conv_name, _fuse(conv, child))
+                setattr(module, name, nn.Identity())
+        fuse_conv_bn(child)
+    return module
+
+def load_fp32_generator(generator_num, device="cpu"):
+    """Load generator_{n}.pth into a fresh eval-mode model."""
+    Generator = load_generator_module(generator_num)
+    generator = Generator().to(device)
+    generator_path = os.path.join(MODEL_DIR, f"generator_{generator_num}.pth")
+    generator.load_state_dict(torch.load(generator_path, map_location=device))
+    return generator.eval()
+
+def export_optimized(generator, size=512):
+    """Fuse conv+BN, then trace, freeze and optimize with TorchScript (folds conv+ReLU where possible)."""
+    fused = fuse_conv_bn(generator)
+    example = torch.zeros(1, 1, size, size)
+    with torch.no_grad():
+        traced = torch.jit.trace(fused, example)
+    return torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+
+def max_abs_diff(reference, candidate, size=512, batch_size=2, seed=0):
+    """Compare two generators on the same random sketches."""
+    torch.manual_seed(seed)
+    sketch_tensor = torch.rand(batch_size, 1, size, size) * 2 - 1
+    with torch.no_grad():
+        return (reference(sketch_tensor) - candidate(sketch_tensor)).abs().max().item()
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a BatchNorm-folded TorchScript generator for CPU inference.")
+    parser.add_argument("--generator_num", type=int, default=1, choices=[1, 2, 3], help="Generator model to export.")
+    parser.add_argument("--size", type=int, default=512, help="Sketch size used for tracing and checking.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1e-3,
+        help="Maximum allowed absolute difference from the unfused model. Default is 1e-3."
+    )
+    args = parser.parse_args()
+
+    reference = load_fp32_generator(args.generator_num)
+    optimized = export_optimized(load_fp32_generator(args.generator_num), args.size)
+
+    # Equivalence check against the unfused model
+    diff = max_abs_diff(reference, optimized, args.size)
+    print(f"Max abs diff vs unfused model: {diff:.2e}")
+    if diff > args.tolerance:
+        raise SystemExit(f"Optimized generator differs by {diff:.2e}, above tolerance {args.tolerance}")
+
+    output_path = artifact_path(args.generator_num, "optimized")
+    torch.jit.save(optimized, output_path)
+    print(f"Optimized generator saved at: {output_path}")
+
+if __name__ == "__main__":
+    main()
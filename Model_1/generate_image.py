@@ -2,24 +2,16 @@ import torch
 from torchvision import transforms
 from PIL import Image
 import os
-from datetime import datetime
+import io
+import uuid
 import argparse
+import threading
+import contextlib
 import numpy as np
 import cv2  # Add OpenCV import
-
-# Dynamic import based on generator number
-def load_generator_module(generator_num):
-    if generator_num == 2:
-        from sketch_to_image_gan_2 import Generator
-    else:
-        from sketch_to_image_gan import Generator
-    return Generator
-
-# Set device
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-# Get the absolute path to the model directory
-MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+import torch.nn.functional as F
+# load_generator_module moved to model_registry; re-exported for callers that import it from here
+from model_registry import registry, load_generator_module, device, atomic_path, MODEL_DIR, VARIANTS  # noqa: F401
 
 # Define image transformations (same as training)
 transform = transforms.Compose([
@@ -29,12 +21,94 @@ transform = transforms.Compose([
     transforms.Normalize([0.5], [0.5])  # Normalize to [-1, 1]
 ])
 
-def preprocess_sketch(sketch_path):
-    """Apply preprocessing to enhance sketch quality before generation using OpenCV."""
-    # Load the image using OpenCV in grayscale
-    image = cv2.imread(sketch_path, cv2.IMREAD_GRAYSCALE)
+# Numeric precision for inference: bf16 autocasts the fp32 model, int8 loads the quantized artifact
+PRECISIONS = ("fp32", "bf16", "int8")
+
+def precision_context(precision):
+    """Return the autocast context for a precision (a no-op for fp32 and int8)."""
+    if precision == "bf16":
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+def model_variant(variant, precision):
+    """Return the registry variant to load; int8 inference uses the artifact from quantize_generator.py."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}")
+    if precision == "int8":
+        if variant not in (None, "int8"):
+            raise ValueError(f"int8 precision cannot be combined with the {variant} variant")
+        return "int8"
+    return variant
+
+# Model input size (height, width), matching training
+SKETCH_SIZE = (512, 512)
+
+class _StagingBuffer(threading.local):
+    """Per-thread float buffer reused to hold decoded sketches before resizing."""
+
+    def __init__(self):
+        self.tensor = torch.empty(0)
+
+    def get(self, numel):
+        if self.tensor.numel() < numel:
+            self.tensor = torch.empty(numel)
+        return self.tensor[:numel]
+
+_staging = _StagingBuffer()
+
+def sketches_to_tensor(sketches, size=SKETCH_SIZE, out=None):
+    """Resize and normalize a batch of sketches into a ``[B,1,H,W]`` tensor in [-1, 1].
+
+    Equivalent to applying ``transform`` to each sketch, without the PIL round-trips:
+    each sketch (grayscale array or PIL image) is copied once into a reusable staging
+    buffer, resized with antialiased bilinear interpolation and written into ``out``
+    (a CPU tensor, e.g. pinned memory), which is allocated when not given. Normalization runs once over the whole batch.
+    """
+    if out is None:
+        out = torch.empty(len(sketches), 1, *size)
+    for i, sketch in enumerate(sketches):
+        image = np.asarray(sketch)
+        if image.ndim == 3:
+            # Ensure single-channel input
+            image = cv2.cvtColor(image, cv2.COLOR_RGBA2GRAY if image.shape[2] == 4 else cv2.COLOR_RGB2GRAY)
+        height, width = image.shape
+        if (height, width) == tuple(size):
+            np.copyto(out[i, 0].numpy(), image)
+            continue
+        src = _staging.get(height * width).view(1, 1, height, width)
+        np.copyto(src.numpy()[0, 0], image)
+        out[i:i + 1] = F.interpolate(src, size=size, mode="bilinear", align_corners=False, antialias=True)
+    # ToTensor and Normalize([0.5], [0.5]) fused: x / 255 * 2 - 1
+    return out.mul_(2 / 255).sub_(1)
+
+def decode_sketch(data):
+    """Decode encoded image bytes (e.g. an upload) straight to a grayscale NumPy array.
+
+    Raises ValueError for empty or undecodable bytes.
+    """
+    if not data:
+        raise ValueError("Uploaded image is empty")
+    try:
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    except cv2.error as e:
+        raise ValueError(f"Failed to decode uploaded image: {e}")
     if image is None:
-        raise ValueError(f"Failed to load image at {sketch_path}")
+        raise ValueError("Failed to decode uploaded image")
+    return image
+
+def preprocess_sketch(sketch):
+    """Apply preprocessing to enhance sketch quality before generation using OpenCV.
+
+    ``sketch`` is either a path or an already decoded grayscale array; the enhanced
+    sketch is returned as a grayscale uint8 array.
+    """
+    if isinstance(sketch, np.ndarray):
+        image = sketch
+    else:
+        # Load the image using OpenCV in grayscale
+        image = cv2.imread(sketch, cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            raise ValueError(f"Failed to load image at {sketch}")
 
     # Apply Gaussian blur to reduce noise
     blurred = cv2.GaussianBlur(image, (5, 5), 0)
@@ -43,88 +117,259 @@ def preprocess_sketch(sketch_path):
     edges = cv2.Canny(blurred, 50, 150)
 
     # Optional: Enhance contrast further (if needed)
-    edges = np.clip((edges.astype(np.float32) - 128) * 1.5 + 128, 0, 255).astype(np.uint8)
+    return np.clip((edges.astype(np.float32) - 128) * 1.5 + 128, 0, 255).astype(np.uint8)
+
+def make_noisy_copies(sketch_tensor, num_samples=3, noise_std=0.02, seed=None):
+    """Repeat every sketch in a ``[B,1,H,W]`` batch ``num_samples`` times and add small noise."""
+    rng = None
+    if seed is not None:
+        rng = torch.Generator(device=sketch_tensor.device).manual_seed(seed)
+
+    noisy_sketch = sketch_tensor.repeat_interleave(num_samples, dim=0)
+    noise = torch.randn(noisy_sketch.shape, generator=rng, device=noisy_sketch.device, dtype=noisy_sketch.dtype)
+    return noisy_sketch.add_(noise.mul_(noise_std))
+
+def ensemble_generate(generator, sketch_tensor, num_samples=3, noise_std=0.02, seed=None):
+    """Average generations of noisy copies of each sketch using a single batched forward pass.
+
+    ``sketch_tensor`` is a ``[B,1,H,W]`` batch; all ``B*num_samples`` noisy copies
+    are generated together and averaged on-device, returning ``[B,3,H,W]``.
+    """
+    batch_size = sketch_tensor.shape[0]
+    generated = generator(make_noisy_copies(sketch_tensor, num_samples, noise_std, seed))
+    return generated.view(batch_size, num_samples, *generated.shape[1:]).mean(dim=1)
+
+def ensemble_generate_loop(generator, sketch_tensor, num_samples=3, noise_std=0.02, seed=None):
+    """Reference ensemble running one forward pass per noisy copy (the original approach)."""
+    rng = None
+    if seed is not None:
+        rng = torch.Generator(device=sketch_tensor.device).manual_seed(seed)
+
+    generated_images = []
+    for _ in range(num_samples):
+        # Add small noise to sketch input
+        noise = torch.randn(sketch_tensor.shape, generator=rng, device=sketch_tensor.device, dtype=sketch_tensor.dtype)
+        noisy_sketch = sketch_tensor + noise * noise_std
+
+        # Generate image
+        generated_images.append(generator(noisy_sketch))
+
+    # Average the generated images
+    return torch.mean(torch.stack(generated_images), dim=0)
+
+def prepare_generator_input(sketch_tensor, ensemble=True, ensemble_samples=3, noise_std=0.02, seed=None):
+    """Return the rows a single sketch contributes to a forward pass (noisy copies when ensembling)."""
+    if ensemble:
+        return make_noisy_copies(sketch_tensor, ensemble_samples, noise_std, seed)
+    return sketch_tensor
+
+def run_batched_forward(generator, inputs, precision="fp32"):
+    """Run several requests' generator inputs through one forward pass.
+
+    Each element of ``inputs`` is a ``[k,1,H,W]`` tensor from ``prepare_generator_input``;
+    the result for each is the ``[1,3,H,W]`` mean over its ``k`` rows.
+    """
+    counts = [x.shape[0] for x in inputs]
+    with torch.no_grad(), precision_context(precision):
+        generated = generator(torch.cat(inputs, dim=0)).float()
+    return [chunk.mean(dim=0, keepdim=True) for chunk in torch.split(generated, counts, dim=0)]
+
+def _tile_starts(length, tile_size, stride):
+    """Offsets of tiles covering [0, length), the last one flush with the end."""
+    starts = list(range(0, length - tile_size + 1, stride))
+    if starts[-1] + tile_size < length:
+        starts.append(length - tile_size)
+    return starts
+
+def _blend_window(tile_size, overlap, tensor):
+    """2D weights ramping linearly up over the overlap at every tile edge."""
+    ramp = torch.ones(tile_size, dtype=tensor.dtype, device=tensor.device)
+    if overlap > 0:
+        edge = torch.linspace(0, 1, overlap + 2, dtype=tensor.dtype, device=tensor.device)[1:-1]
+        ramp[:overlap] = edge
+        ramp[-overlap:] = edge.flip(0)
+    return ramp[:, None] * ramp[None, :]
+
+def tiled_generate(generator, sketch_tensor, tile_size=512, overlap=64, tile_batch_size=4,
+                   ensemble=False, ensemble_samples=3, noise_std=0.02, seed=None):
+    """Generate a full-resolution ``[1,1,H,W]`` sketch in overlapping tiles and blend the seams.
+
+    Tiles of ``tile_size`` pixels (a multiple of 4, as both generators downsample by up
+    to 4) run ``tile_batch_size`` at a time, so peak activation memory depends only on
+    those settings and not on the sketch resolution. Overlapping regions are averaged
+    with weights that fade out towards each tile's edge.
+    """
+    if tile_size % 4 != 0:
+        raise ValueError(f"tile_size must be a multiple of 4, got {tile_size}")
+    if not 0 <= overlap < tile_size // 2:
+        raise ValueError(f"overlap must be in [0, {tile_size // 2}), got {overlap}")
+
+    # Pad sketches smaller than a tile so every tile is full size
+    height, width = sketch_tensor.shape[-2:]
+    pad_h, pad_w = max(0, tile_size - height), max(0, tile_size - width)
+    if pad_h or pad_w:
+        sketch_tensor = F.pad(sketch_tensor, (0, pad_w, 0, pad_h), mode="replicate")
+    padded_h, padded_w = sketch_tensor.shape[-2:]
+
+    stride = tile_size - overlap
+    positions = [(y, x) for y in _tile_starts(padded_h, tile_size, stride)
+                 for x in _tile_starts(padded_w, tile_size, stride)]
+    window = _blend_window(tile_size, overlap, sketch_tensor)
+    output = torch.zeros(1, 3, padded_h, padded_w, dtype=sketch_tensor.dtype, device=sketch_tensor.device)
+    weights = torch.zeros(1, 1, padded_h, padded_w, dtype=sketch_tensor.dtype, device=sketch_tensor.device)
+
+    for i in range(0, len(positions), tile_batch_size):
+        batch_positions = positions[i:i + tile_batch_size]
+        tiles = torch.cat([sketch_tensor[..., y:y + tile_size, x:x + tile_size] for y, x in batch_positions])
+        if ensemble:
+            tile_seed = None if seed is None else seed + i
+            generated = ensemble_generate(generator, tiles, ensemble_samples, noise_std, tile_seed)
+        else:
+            generated = generator(tiles)
+        for tile, (y, x) in zip(generated.float(), batch_positions):
+            output[..., y:y + tile_size, x:x + tile_size] += tile * window
+            weights[..., y:y + tile_size, x:x + tile_size] += window
+
+    return (output / weights)[..., :height, :width]
+
+def load_sketch(sketch, enhance_sketch=True):
+    """Load a sketch (path or grayscale array) as a grayscale uint8 array, enhancing it if requested."""
+    if enhance_sketch:
+        return preprocess_sketch(sketch)
+    if isinstance(sketch, np.ndarray):
+        return sketch
+    return np.asarray(Image.open(sketch).convert("L"))
+
+def sketch_to_tensor(sketch, size=SKETCH_SIZE):
+    """Transform a sketch into a ``[1,1,512,512]`` tensor on the model device.
+
+    With ``size=None`` the sketch keeps its native resolution (for tiled inference).
+    """
+    if size is None:
+        size = np.asarray(sketch).shape[:2]
+    return sketches_to_tensor([sketch], size=size).to(device)
+
+def tensor_to_image(generated_image):
+    """Convert a ``[1,3,H,W]`` generator output in [-1, 1] to a uint8 HWC array."""
+    generated_image = (generated_image.squeeze(0).permute(1, 2, 0).cpu().numpy() + 1) / 2  # Convert to [0,1]
+    return (generated_image * 255).astype("uint8")  # Convert to uint8
+
+# PIL format, file extension and media type of each output encoding
+OUTPUT_FORMATS = {
+    "png": ("PNG", ".png", "image/png"),
+    "webp": ("WEBP", ".webp", "image/webp"),
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+}
+
+def encode_image(image, fmt="png", quality=None, compress_level=None):
+    """Encode a uint8 array or PIL image to PNG/WebP/JPEG bytes in memory.
 
-    # Convert back to PIL Image
-    enhanced_sketch = Image.fromarray(edges)
+    ``compress_level`` (0-9) trades PNG size against encoding time and ``quality``
+    (1-100) sets WebP and JPEG quality; None keeps PIL's defaults.
+    """
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    params = {}
+    if fmt == "png" and compress_level is not None:
+        params["compress_level"] = compress_level
+    elif fmt in ("webp", "jpeg") and quality is not None:
+        params["quality"] = quality
+    buffer = io.BytesIO()
+    image.save(buffer, format=OUTPUT_FORMATS[fmt][0], **params)
+    return buffer.getvalue()
 
-    return enhanced_sketch
+def make_thumbnail(image, max_size=256):
+    """Downscale a uint8 array or PIL image to fit in max_size x max_size, keeping its aspect ratio."""
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    thumbnail = image.copy()
+    # reducing_gap first shrinks by an integer factor, which is much cheaper than a full resample
+    thumbnail.thumbnail((max_size, max_size), Image.Resampling.BICUBIC, reducing_gap=2.0)
+    return thumbnail
 
-def generate_image(sketch_path, output_dir="generated_images", enhance_sketch=True, ensemble=True, generator_num=1):
-    """Generate an image from a sketch with optional enhancements."""
+def thumbnail_path(output_path, fmt):
+    """Return the path of the thumbnail for a generated image path."""
+    directory, name = os.path.split(output_path)
+    name = os.path.splitext(name)[0].replace("generated_image_", "thumbnail_", 1)
+    return os.path.join(directory, f"{name}{OUTPUT_FORMATS[fmt][1]}")
+
+def new_output_id():
+    """Return a random identifier for a result, unique across threads, processes and hosts."""
+    return uuid.uuid4().hex
+
+def write_atomic(path, data):
+    """Write bytes or a PIL image to path via a uniquely named temporary file and a rename."""
+    with atomic_path(path) as tmp_path:
+        if isinstance(data, Image.Image):
+            data.save(tmp_path, format=Image.registered_extensions()[os.path.splitext(path)[1].lower()])
+        else:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+
+def output_paths(output_dir, output_id=None, fmt="png"):
+    """Return the generated image and input sketch paths for a new result in output_dir.
+
+    Results are named after ``output_id`` when given (e.g. a content hash), otherwise
+    after a new random identifier, so concurrent requests never share a name. The
+    generated image gets the extension of ``fmt``; the sketch is always PNG.
+    """
     # Make output_dir absolute if it's relative
     if not os.path.isabs(output_dir):
         output_dir = os.path.join(MODEL_DIR, output_dir)
-        
+
     # Ensure the output directory exists
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    
-    # Load the specified generator model
-    Generator = load_generator_module(generator_num)
-    generator = Generator().to(device)
-    generator_path = os.path.join(MODEL_DIR, f"generator_{generator_num}.pth")
-    
-    # Check if the generator file exists
-    if not os.path.exists(generator_path):
-        raise FileNotFoundError(f"Generator model not found: {generator_path}")
-    
-    generator.load_state_dict(torch.load(generator_path, map_location=device))
-    generator.eval()
-
-    # Generate the timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-    # Create the output file path with the timestamp
-    output_filename = f"generated_image_{timestamp}.png"
-    output_path = os.path.join(output_dir, output_filename)
-    
-    # Save original sketch for comparison
-    sketch_output_path = os.path.join(output_dir, f"input_sketch_{timestamp}.png")
-    
-    # Preprocess the sketch if enhancement is enabled
-    if enhance_sketch:
-        sketch = preprocess_sketch(sketch_path)
-        sketch.save(sketch_output_path)
-    else:
-        sketch = Image.open(sketch_path).convert("L")
-        sketch.save(sketch_output_path)
-    
+
+    if output_id is None:
+        output_id = new_output_id()
+
+    # Create the output file paths with the identifier
+    output_path = os.path.join(output_dir, f"generated_image_{output_id}{OUTPUT_FORMATS[fmt][1]}")
+    sketch_output_path = os.path.join(output_dir, f"input_sketch_{output_id}.png")
+    return output_path, sketch_output_path
+
+# Generator used for progressive drafts: a single pass of the lighter model 2 takes a fraction of an ensemble
+DRAFT_GENERATOR_NUM = 2
+
+def generate_image(sketch_path, output_dir="generated_images", enhance_sketch=True, ensemble=True, generator_num=1,
+                   ensemble_samples=3, noise_std=0.02, seed=None, variant=None, precision="fp32",
+                   tile_size=None, tile_overlap=64):
+    """Generate an image from a sketch with optional enhancements.
+
+    ``variant`` selects an exported generator artifact such as "optimized" (see export_generator.py)
+    and ``precision`` one of ``PRECISIONS``. With ``tile_size`` the sketch is generated at its
+    native resolution in overlapping tiles instead of being resized to 512x512.
+    """
+    output_path, sketch_output_path = output_paths(output_dir)
+
+    # Look up the specified generator model (loaded once per process)
+    generator = registry.get(generator_num, model_variant(variant, precision))
+
+    # Preprocess the sketch if enhancement is enabled and save it for comparison
+    sketch = load_sketch(sketch_path, enhance_sketch)
+    write_atomic(sketch_output_path, Image.fromarray(sketch))
+
     # Transform the sketch
-    sketch_tensor = transform(sketch).unsqueeze(0).to(device)
-    
+    sketch_tensor = sketch_to_tensor(sketch, size=None if tile_size else SKETCH_SIZE)
+
     # Generate with ensemble if enabled (average multiple generations with small noise)
-    if ensemble:
-        with torch.no_grad():
-            # Generate multiple versions with noise and average them
-            num_samples = 3
-            generated_images = []
-            
-            for _ in range(num_samples):
-                # Add small noise to sketch input
-                noise = torch.randn_like(sketch_tensor) * 0.02
-                noisy_sketch = sketch_tensor + noise
-                
-                # Generate image
-                gen_img = generator(noisy_sketch)
-                generated_images.append(gen_img)
-            
-            # Average the generated images
-            generated_image = torch.mean(torch.stack(generated_images), dim=0)
-    else:
-        # Single generation
-        with torch.no_grad():
+    with torch.no_grad(), precision_context(precision):
+        if tile_size:
+            generated_image = tiled_generate(generator, sketch_tensor, tile_size, tile_overlap, ensemble=ensemble,
+                                             ensemble_samples=ensemble_samples, noise_std=noise_std, seed=seed)
+        elif ensemble:
+            generated_image = ensemble_generate(generator, sketch_tensor, ensemble_samples, noise_std, seed)
+        else:
+            # Single generation
             generated_image = generator(sketch_tensor)
+    generated_image = generated_image.float()
 
-    # Post-process: Convert output tensor to image
-    generated_image = (generated_image.squeeze(0).permute(1, 2, 0).cpu().numpy() + 1) / 2  # Convert to [0,1]
-    generated_image = (generated_image * 255).astype("uint8")  # Convert to uint8
-
-    # Save the image
-    Image.fromarray(generated_image).save(output_path)
+    # Post-process and save the image
+    write_atomic(output_path, Image.fromarray(tensor_to_image(generated_image)))
     print(f"Generated image saved at: {output_path}")
     print(f"Input sketch saved at: {sketch_output_path}")
-    
+
     return output_path, sketch_output_path
 
 # Parse command-line arguments
@@ -159,7 +404,62 @@ if __name__ == "__main__":
         choices=[1, 2, 3],
         help="Generator model to use (1, 2, or 3)."
     )
+    parser.add_argument(
+        "--ensemble_samples",
+        type=int,
+        default=3,
+        help="Number of noisy copies averaged in ensemble mode. Default is 3."
+    )
+    parser.add_argument(
+        "--noise_std",
+        type=float,
+        default=0.02,
+        help="Standard deviation of the noise added to each ensemble copy. Default is 0.02."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed for the ensemble noise, for reproducible results."
+    )
+    parser.add_argument(
+        "--variant",
+        type=str,
+        default=None,
+        choices=VARIANTS,
+        help="Load an exported generator artifact instead of the .pth weights."
+    )
+    parser.add_argument(
+        "--precision",
+        type=str,
+        default="fp32",
+        choices=PRECISIONS,
+        help="Inference precision: fp32, bf16 autocast or the int8 quantized model. Default is fp32."
+    )
+    parser.add_argument(
+        "--tile_size",
+        type=int,
+        default=None,
+        help="Generate at full resolution in tiles of this size (a multiple of 4) instead of resizing to 512x512."
+    )
+    parser.add_argument(
+        "--tile_overlap",
+        type=int,
+        default=64,
+        help="Overlap in pixels between neighbouring tiles, blended to hide seams. Default is 64."
+    )
+    parser.add_argument(
+        "--progressive",
+        action="store_true",
+        help="Save a quick draft (generator 2, no ensemble) before the full result."
+    )
     args = parser.parse_args()
 
+    if args.progressive:
+        generate_image(args.sketch_path, args.output_dir, args.enhance, ensemble=False,
+                       generator_num=DRAFT_GENERATOR_NUM, seed=args.seed, precision=args.precision)
+
     # Generate the image
-    generate_image(args.sketch_path, args.output_dir, args.enhance, args.ensemble, args.generator_num)
\ No newline at end of file
+    generate_image(args.sketch_path, args.output_dir, args.enhance, args.ensemble, args.generator_num,
+                   args.ensemble_samples, args.noise_std, args.seed, args.variant, args.precision,
+                   args.tile_size, args.tile_overlap)
\ No newline at end of file
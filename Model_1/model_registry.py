@@ -0,0 +1,269 @@
+import os
+import uuid
+import logging
+import threading
+import contextlib
+from collections import OrderedDict
+import torch
+
+logger = logging.getLogger("vasthra-models")
+
+# Set device
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+# Get the absolute path to the model directory
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Generator numbers that have weights shipped with the project
+GENERATOR_NUMS = (1, 2, 3)
+
+# Exported artifacts that can be loaded instead of the .pth weights
+VARIANTS = ("optimized", "int8")
+
+# Dynamic import based on generator number
+def load_generator_module(generator_num):
+    if generator_num == 2:
+        from sketch_to_image_gan_2 import Generator
+    else:
+        from sketch_to_image_gan import Generator
+    return Generator
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """Yield a uniquely named temporary path to write, then rename it over path.
+
+    Readers never see a partial file, and concurrent writers of the same path each
+    replace it whole, so the last complete write wins. The temporary file is removed
+    if writing fails.
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def artifact_path(generator_num, variant=None, model_dir=MODEL_DIR):
+    """Return the weights file for a generator: the .pth state dict, or an exported TorchScript variant."""
+    if variant is None:
+        return os.path.join(model_dir, f"generator_{generator_num}.pth")
+    return os.path.join(model_dir, f"generator_{generator_num}_{variant}.pt")
+
+def shared_weights_path(generator_path, model_dir=MODEL_DIR):
+    """Return the mmap-ready copy of a .pth file shared by every process on the host.
+
+    The name records the size and modification time of the .pth it was made from,
+    so replacing the weights (even with an older file) gives a new copy.
+    """
+    stat = os.stat(generator_path)
+    name = os.path.splitext(os.path.basename(generator_path))[0]
+    return os.path.join(model_dir, "shared_weights", f"{name}_{stat.st_size}_{stat.st_mtime_ns}.pt")
+
+def prepare_shared_weights(generator_path, shared_path):
+    """Write an mmap-loadable copy of a .pth state dict unless it exists, removing copies of older weights.
+
+    ``torch.load(mmap=True)`` needs the zipfile format, which older .pth files may
+    predate. Processes racing to write it each rename a complete file into place.
+    """
+    if os.path.exists(shared_path):
+        return shared_path
+    shared_dir = os.path.dirname(shared_path)
+    os.makedirs(shared_dir, exist_ok=True)
+    with atomic_path(shared_path) as tmp_path:
+        torch.save(torch.load(generator_path, map_location="cpu"), tmp_path)
+    # Processes still mapping an old copy keep its pages until they reload
+    prefix = f"{os.path.splitext(os.path.basename(generator_path))[0]}_"
+    for name in os.listdir(shared_dir):
+        stale = os.path.join(shared_dir, name)
+        if name.startswith(prefix) and name.endswith(".pt") and stale != shared_path:
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+    return shared_path
+
+def configure_threads(num_threads=None):
+    """Size torch's intra-op thread pool so several processes on one host don't oversubscribe the cores.
+
+    Uses ``num_threads``, else VASTHRA_TORCH_THREADS, else the available cores divided
+    by VASTHRA_WORKER_PROCESSES when that is set; otherwise torch's default is kept.
+    """
+    if num_threads is None and os.environ.get("VASTHRA_TORCH_THREADS"):
+        num_threads = int(os.environ["VASTHRA_TORCH_THREADS"])
+    if num_threads is None and os.environ.get("VASTHRA_WORKER_PROCESSES"):
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        num_threads = max(1, cores // int(os.environ["VASTHRA_WORKER_PROCESSES"]))
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+        logger.info(f"Using {num_threads} torch threads")
+    return torch.get_num_threads()
+
+def model_size_bytes(model):
+    """Return the memory held by a model's parameters and buffers in bytes."""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+class _Entry:
+    def __init__(self, model, mtime, size_bytes):
+        self.model = model
+        self.mtime = mtime
+        self.size_bytes = size_bytes
+
+class ModelRegistry:
+    """Process-wide cache of generators kept resident in eval mode.
+
+    Generators are loaded on first use (or eagerly through ``preload``),
+    evicted least-recently-used first once ``memory_budget_mb`` is exceeded,
+    and reloaded when the mtime of their ``.pth`` file changes. A ``variant``
+    selects an exported TorchScript artifact (see export_generator.py) instead.
+
+    With ``shared_weights`` on CPU, fp32 weights are memory-mapped from a copy in
+    ``shared_weights/`` rather than read into private memory, so every process
+    serving the same generator shares one set of physical pages.
+    """
+
+    def __init__(self, model_dir=MODEL_DIR, device=device, memory_budget_mb=None, shared_weights=False):
+        self.model_dir = model_dir
+        self.device = device
+        self.memory_budget_mb = memory_budget_mb
+        self.shared_weights = shared_weights
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per generator so concurrent first requests load it only once
+        self._load_locks = {}
+
+    def weights_path(self, generator_num, variant=None):
+        return artifact_path(generator_num, variant, self.model_dir)
+
+    def get(self, generator_num, variant=None):
+        """Return the resident generator, loading or reloading it if needed."""
+        key = (generator_num, variant)
+        generator_path = self.weights_path(generator_num, variant)
+
+        # Check if the generator file exists
+        if not os.path.exists(generator_path):
+            raise FileNotFoundError(f"Generator model not found: {generator_path}")
+        mtime = os.path.getmtime(generator_path)
+
+        model = self._lookup(key, mtime)
+        if model is not None:
+            return model
+
+        with self._load_lock(key):
+            # Another thread may have loaded it while we waited
+            model = self._lookup(key, mtime)
+            if model is not None:
+                return model
+
+            with self._lock:
+                stale = self._entries.get(key)
+            try:
+                model = self._load(generator_num, variant, generator_path)
+            except Exception:
+                # The file may still be mid-write; keep serving the old weights
+                if stale is not None:
+                    logger.warning(f"Reloading generator {generator_num} failed, keeping previous weights",
+                                   exc_info=True)
+                    return stale.model
+                raise
+
+            # Frozen TorchScript modules hold their weights as constants, so fall back to the file size
+            size_bytes = model_size_bytes(model) or os.path.getsize(generator_path)
+            with self._lock:
+                self._entries[key] = _Entry(model, mtime, size_bytes)
+                self._entries.move_to_end(key)
+                self._evict_over_budget()
+            return model
+
+    def preload(self, generator_nums=GENERATOR_NUMS, variant=None):
+        """Eagerly load the given generators, skipping ones without weights."""
+        loaded = []
+        for generator_num in generator_nums:
+            try:
+                self.get(generator_num, variant)
+                loaded.append(generator_num)
+            except FileNotFoundError as e:
+                logger.warning(str(e))
+        return loaded
+
+    def evict(self, generator_num, variant=None):
+        with self._lock:
+            self._entries.pop((generator_num, variant), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def resident(self):
+        """Return the (generator number, variant) pairs currently held in memory, oldest first."""
+        with self._lock:
+            return list(self._entries.keys())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "device": str(self.device),
+                "memory_budget_mb": self.memory_budget_mb,
+                "resident_mb": sum(e.size_bytes for e in self._entries.values()) / 2**20,
+                "models": {
+                    f"{num}" if variant is None else f"{num}_{variant}": e.size_bytes / 2**20
+                    for (num, variant), e in self._entries.items()
+                },
+            }
+
+    def _lookup(self, key, mtime):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.mtime != mtime:
+                return None
+            self._entries.move_to_end(key)
+            return entry.model
+
+    def _load_lock(self, key):
+        with self._lock:
+            return self._load_locks.setdefault(key, threading.Lock())
+
+    def _load(self, generator_num, variant, generator_path):
+        logger.info(f"Loading generator {generator_num} from {generator_path}")
+        if variant == "int8":
+            # Quantized kernels only run on CPU
+            return torch.jit.load(generator_path, map_location="cpu").eval()
+        if variant is not None:
+            return torch.jit.load(generator_path, map_location=self.device).eval()
+        Generator = load_generator_module(generator_num)
+        if self.shared_weights and self.device.type == "cpu":
+            shared_path = prepare_shared_weights(generator_path, shared_weights_path(generator_path, self.model_dir))
+            # assign=True keeps the mmap-backed tensors instead of copying them into freshly allocated ones;
+            # inference never writes to them, so the copy-on-write pages stay shared
+            generator = Generator()
+            generator.load_state_dict(torch.load(shared_path, map_location="cpu", mmap=True), assign=True)
+        else:
+            generator = Generator().to(self.device)
+            generator.load_state_dict(torch.load(generator_path, map_location=self.device))
+        generator.eval()
+        generator.requires_grad_(False)
+        return generator
+
+    def _evict_over_budget(self):
+        if self.memory_budget_mb is None:
+            return
+        budget = self.memory_budget_mb * 2**20
+        # Always keep the most recently used model, even if it alone exceeds the budget
+        while len(self._entries) > 1 and sum(e.size_bytes for e in self._entries.values()) > budget:
+            (generator_num, variant), _ = self._entries.popitem(last=False)
+            logger.info(f"Evicted generator {generator_num} ({variant or 'fp32'}) to stay within "
+                        f"{self.memory_budget_mb} MB")
+
+def _budget_from_env():
+    value = os.environ.get("VASTHRA_MODEL_MEMORY_MB")
+    return float(value) if value else None
+
+# Shared registry used by generate_image and the API
+registry = ModelRegistry(memory_budget_mb=_budget_from_env(),
+                         shared_weights=os.environ.get("VASTHRA_SHARED_WEIGHTS", "0") == "1")
+
+def get_generator(generator_num, variant=None):
+    """Look up a resident generator from the shared registry."""
+    return registry.get(generator_num, variant)
@@ -0,0 +1,73 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+
+# Index file describing the shards of a packed dataset
+INDEX_FILENAME = "index.json"
+
+def shard_filenames(shard_num):
+    return f"shard_{shard_num:05d}.sketches.npy", f"shard_{shard_num:05d}.real.npy"
+
+def _load_resized(path, size, flags):
+    image = cv2.imread(path, flags)
+    if image is None:
+        raise ValueError(f"Failed to load image at {path}")
+    # INTER_AREA gives antialiased downscaling, close to PIL's Resize
+    image = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return image
+
+def pack_shard(shard_num, filenames, sketch_dir, real_dir, output_dir, size):
+    """Decode, resize and write one shard of sketch/real pairs as uint8 .npy files."""
+    sketch_name, real_name = shard_filenames(shard_num)
+    sketches = np.lib.format.open_memmap(
+        os.path.join(output_dir, sketch_name), mode="w+", dtype=np.uint8, shape=(len(filenames), size, size)
+    )
+    reals = np.lib.format.open_memmap(
+        os.path.join(output_dir, real_name), mode="w+", dtype=np.uint8, shape=(len(filenames), size, size, 3)
+    )
+    for i, filename in enumerate(filenames):
+        sketches[i] = _load_resized(os.path.join(sketch_dir, filename), size, cv2.IMREAD_GRAYSCALE)
+        reals[i] = _load_resized(os.path.join(real_dir, filename), size, cv2.IMREAD_COLOR)
+    sketches.flush()
+    reals.flush()
+    return len(filenames)
+
+def pack_dataset(sketch_dir, real_dir, output_dir, size=512, shard_size=1024, num_workers=4):
+    """Pack matching sketch/real pairs into resized, memory-mappable uint8 shards."""
+    os.makedirs(output_dir, exist_ok=True)
+    filenames = sorted(name for name in os.listdir(sketch_dir) if os.path.exists(os.path.join(real_dir, name)))
+    shards = [filenames[i:i + shard_size] for i in range(0, len(filenames), shard_size)]
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(pack_shard, shard_num, shard, sketch_dir, real_dir, output_dir, size)
+            for shard_num, shard in enumerate(shards)
+        ]
+        counts = [future.result() for future in futures]
+
+    index = {"size": size, "shard_counts": counts, "filenames": filenames}
+    with open(os.path.join(output_dir, INDEX_FILENAME), "w") as f:
+        json.dump(index, f)
+    return len(filenames)
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack sketch/real image pairs into memory-mapped uint8 shards.")
+    parser.add_argument("--sketch_dir", type=str, required=True, help="Directory of sketch images.")
+    parser.add_argument("--real_dir", type=str, required=True, help="Directory of real images with matching names.")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory for the packed shards.")
+    parser.add_argument("--size", type=int, default=512, help="Height and width to resize to. Default is 512.")
+    parser.add_argument("--shard_size", type=int, default=1024, help="Pairs per shard. Default is 1024.")
+    parser.add_argument("--num_workers", type=int, default=4, help="Parallel packing processes. Default is 4.")
+    args = parser.parse_args()
+
+    count = pack_dataset(args.sketch_dir, args.real_dir, args.output_dir, args.size, args.shard_size,
+                         args.num_workers)
+    print(f"Packed {count} pairs into {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import argparse
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from benchmark_utils import SAMPLE_DIR, sample_sketch_paths
+from model_registry import artifact_path
+from export_generator import load_fp32_generator, max_abs_diff
+from generate_image import preprocess_sketch, sketches_to_tensor, make_noisy_copies
+
+def calibration_batches(sketch_dir=SAMPLE_DIR, ensemble_samples=3, noise_std=0.02):
+    """Yield preprocessed sample sketches, with ensemble noise, as the model sees them at inference."""
+    for path in sample_sketch_paths(sketch_dir):
+        sketch_tensor = sketches_to_tensor([preprocess_sketch(path)])
+        yield make_noisy_copies(sketch_tensor, ensemble_samples, noise_std, seed=0)
+
+def quantize_int8(generator, sketch_dir=SAMPLE_DIR, size=512):
+    """Static post-training int8 quantization (FX graph mode) calibrated on the sample sketches."""
+    # x86 uses fbgemm kernels and per-tensor weights for ConvTranspose2d
+    torch.backends.quantized.engine = "x86"
+    example = (torch.zeros(1, 1, size, size),)
+    prepared = prepare_fx(generator.eval(), get_default_qconfig_mapping("x86"), example)
+    with torch.no_grad():
+        for batch in calibration_batches(sketch_dir):
+            prepared(batch)
+    quantized = convert_fx(prepared)
+    with torch.no_grad():
+        traced = torch.jit.trace(quantized, example)
+    return torch.jit.freeze(traced.eval())
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a static int8 quantized generator for CPU inference.")
+    parser.add_argument("--generator_num", type=int, default=1, choices=[1, 2, 3], help="Generator model to quantize.")
+    parser.add_argument("--sketch_dir", type=str, default=SAMPLE_DIR, help="Directory of calibration sketches.")
+    args = parser.parse_args()
+
+    reference = load_fp32_generator(args.generator_num)
+    quantized = quantize_int8(load_fp32_generator(args.generator_num), args.sketch_dir)
+    print(f"Max abs diff vs fp32 model: {max_abs_diff(reference, quantized):.3f}")
+
+    output_path = artifact_path(args.generator_num, "int8")
+    torch.jit.save(quantized, output_path)
+    print(f"Quantized generator saved at: {output_path}")
+    print("Use benchmark_quantization.py to compare latency, memory and PSNR/SSIM against fp32.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import glob
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from generate_image import output_paths, write_atomic
+
+def image_for(worker, i, size):
+    """A small image whose pixels identify the writer, so misattributed results can be detected."""
+    rng = np.random.default_rng(worker * 1_000_003 + i)
+    return Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8))
+
+def write_results(worker, output_dir, count, threads, size):
+    """Write count results from several threads of one process; return {path: (worker, i)}."""
+    def write(i):
+        output_path, sketch_output_path = output_paths(output_dir)
+        write_atomic(sketch_output_path, image_for(worker, i, size))
+        write_atomic(output_path, image_for(worker, i, size))
+        return output_path, sketch_output_path, i
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(write, range(count)))
+    return {path: (worker, i) for output_path, sketch_output_path, i in results
+            for path in (output_path, sketch_output_path)}
+
+def check_unique_names(output_dir, processes, threads, count, size):
+    """Write from processes x threads at once and check every result is distinct and intact."""
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(write_results, worker, output_dir, count, threads, size)
+                   for worker in range(processes)]
+        expected = {}
+        for future in futures:
+            expected.update(future.result())
+
+    errors = []
+    if len(expected) != 2 * processes * count:
+        errors.append(f"{2 * processes * count - len(expected)} results were given a name already in use")
+    for path, (worker, i) in expected.items():
+        with Image.open(path) as image:
+            if not np.array_equal(np.asarray(image), np.asarray(image_for(worker, i, size))):
+                errors.append(f"{path} holds another request's result")
+    leftovers = glob.glob(os.path.join(output_dir, "*.tmp"))
+    if leftovers:
+        errors.append(f"{len(leftovers)} temporary files left behind")
+    return errors
+
+def check_atomic_overwrite(output_dir, writers, rounds, size):
+    """Several threads rewrite one content-addressed path while a reader checks it is never partial."""
+    output_path, _ = output_paths(output_dir, output_id="shared")
+    write_atomic(output_path, image_for(0, 0, size))
+    valid = [np.asarray(image_for(writer, 0, size)) for writer in range(writers)]
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            try:
+                with Image.open(output_path) as image:
+                    pixels = np.asarray(image)
+            except Exception as e:
+                errors.append(f"read a partial file: {e}")
+                return
+            if not any(np.array_equal(pixels, expected) for expected in valid):
+                errors.append("read an image that no writer wrote")
+                return
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    with ThreadPoolExecutor(max_workers=writers) as executor:
+        list(executor.map(lambda writer: [write_atomic(output_path, image_for(writer, 0, size)) for _ in range(rounds)],
+                          range(writers)))
+    stop.set()
+    reader.join()
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress-test concurrent output naming and atomic writes.")
+    parser.add_argument("--processes", type=int, default=4, help="Writer processes, like uvicorn workers.")
+    parser.add_argument("--threads", type=int, default=8, help="Writer threads per process.")
+    parser.add_argument("--count", type=int, default=200, help="Results written per process.")
+    parser.add_argument("--size", type=int, default=64, help="Height and width of the test images.")
+    parser.add_argument("--output_dir", type=str, default=None, help="Directory to write to; a temporary one by default.")
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix="stress_output_naming_")
+    try:
+        errors = check_unique_names(output_dir, args.processes, args.threads, args.count, args.size)
+        errors += check_atomic_overwrite(output_dir, args.threads, args.count // args.threads + 1, args.size)
+    finally:
+        if args.output_dir is None:
+            shutil.rmtree(output_dir)
+
+    for error in errors:
+        print(f"FAIL: {error}")
+    if errors:
+        raise SystemExit(1)
+    print(f"OK: {2 * args.processes * args.count} results from {args.processes} processes x {args.threads} threads "
+          f"were distinct and intact; concurrent overwrites were never observed partially written")
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,24 @@
-
 #DATALOADER
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import torch.optim as optim
+import torch.distributed as dist
 import torchvision.transforms as transforms
+from torch.nn.parallel import DistributedDataParallel
 from torch.utils.data import Dataset, DataLoader
+from torch.utils.data.distributed import DistributedSampler
 from PIL import Image
+import argparse
+import bisect
+import contextlib
+import json
 import os
+import time
+import numpy as np
+from pack_dataset import INDEX_FILENAME, shard_filenames
+from model_registry import MODEL_DIR, atomic_path, load_generator_module
 
 # Define dataset class
 class SketchToImageDataset(Dataset):
@@ -23,16 +34,81 @@ class SketchToImageDataset(Dataset):
     def __getitem__(self, idx):
         sketch_path = os.path.join(self.sketch_dir, self.image_filenames[idx])
         real_path = os.path.join(self.real_dir, self.image_filenames[idx])
-        
+
         sketch = Image.open(sketch_path).convert("L")  # Grayscale
         real = Image.open(real_path).convert("RGB")  # Color
-        
+
         if self.transform:
             sketch = self.transform(sketch)
             real = self.transform(real)
-        
+
         return sketch, real
 
+class PackedSketchDataset(Dataset):
+    """Reads pairs packed by pack_dataset.py straight from memory-mapped uint8 shards.
+
+    Items are uint8 tensors viewing the mapped files (``[1,H,W]`` sketch, ``[3,H,W]`` real);
+    use ``normalize_batch`` on the collated batch, ideally after moving it to the device.
+    """
+
+    def __init__(self, packed_dir):
+        self.packed_dir = packed_dir
+        with open(os.path.join(packed_dir, INDEX_FILENAME)) as f:
+            index = json.load(f)
+        self.size = index["size"]
+        self.shard_counts = index["shard_counts"]
+        self.shard_offsets = np.cumsum([0] + self.shard_counts).tolist()
+        # Shards are opened lazily so each DataLoader worker maps them itself
+        self._shards = {}
+
+    def __len__(self):
+        return self.shard_offsets[-1]
+
+    def _shard(self, shard_num):
+        if shard_num not in self._shards:
+            sketch_name, real_name = shard_filenames(shard_num)
+            # Copy-on-write mapping: pages are shared and never copied since nothing writes to them
+            self._shards[shard_num] = (
+                np.load(os.path.join(self.packed_dir, sketch_name), mmap_mode="c"),
+                np.load(os.path.join(self.packed_dir, real_name), mmap_mode="c"),
+            )
+        return self._shards[shard_num]
+
+    def __getitem__(self, idx):
+        shard_num = bisect.bisect_right(self.shard_offsets, idx) - 1
+        sketches, reals = self._shard(shard_num)
+        offset = idx - self.shard_offsets[shard_num]
+        sketch = torch.from_numpy(sketches[offset]).unsqueeze(0)
+        real = torch.from_numpy(reals[offset]).permute(2, 0, 1)
+        return sketch, real
+
+    def __getstate__(self):
+        # Memory maps are not sent to worker processes; they reopen the shards
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+def normalize_batch(batch):
+    """Convert a uint8 image batch to float in [-1, 1], as ``transform`` does."""
+    return batch.float().mul_(2 / 255).sub_(1)
+
+def make_data_loader(dataset, batch_size=4, num_workers=4, pin_memory=None, prefetch_factor=2,
+                     shuffle=True, sampler=None, drop_last=True):
+    """DataLoader with worker processes, pinned memory and prefetching configured for training."""
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle if sampler is None else False,
+        sampler=sampler,
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        prefetch_factor=prefetch_factor if num_workers > 0 else None,
+        persistent_workers=num_workers > 0,
+        drop_last=drop_last,
+    )
+
 # Define transformations
 transform = transforms.Compose([
     transforms.Resize((512, 512)),
@@ -40,11 +116,224 @@ transform = transforms.Compose([
     transforms.Normalize((0.5,), (0.5,))  # Normalize to [-1, 1]
 ])
 
-# Load dataset
-dataset = SketchToImageDataset("D:\\FYP\\trials\\GEN_3_colorful_dataset\\dataset\\sketches", "D:\\FYP\\trials\\GEN_3_colorful_dataset\\dataset\\real_images", transform=transform)
-data_loader = DataLoader(dataset, batch_size=4, shuffle=True)
+# TRAINING
+
+def load_discriminator(generator_num):
+    """Multi-scale discriminator for the first architecture, the single-scale one for the second."""
+    if generator_num == 2:
+        from sketch_to_image_gan_2 import Discriminator
+        return Discriminator()
+    from sketch_to_image_gan import MultiScaleDiscriminator
+    return MultiScaleDiscriminator()
+
+def adversarial_loss(predictions, is_real):
+    """BCE over every discriminator scale, computed in fp32 outside autocast."""
+    if not isinstance(predictions, (tuple, list)):
+        predictions = (predictions,)
+    losses = []
+    with torch.autocast(device_type=predictions[0].device.type, enabled=False):
+        for prediction in predictions:
+            prediction = prediction.float()
+            target = torch.ones_like(prediction) if is_real else torch.zeros_like(prediction)
+            losses.append(F.binary_cross_entropy(prediction, target))
+    return sum(losses) / len(losses)
+
+def unwrap(model):
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+def atomic_save(obj, path):
+    """Write to a temporary file and rename, so readers never see a partial checkpoint."""
+    with atomic_path(path) as tmp_path:
+        torch.save(obj, tmp_path)
+
+def checkpoint_path(output_dir, generator_num):
+    return os.path.join(output_dir, f"checkpoint_{generator_num}.pt")
+
+def save_checkpoint(output_dir, generator_num, generator, discriminator, opt_g, opt_d, scaler, epoch, step):
+    """Save generator_{n}.pth (the weights generate_image loads) and the full state to resume from."""
+    atomic_save(unwrap(generator).state_dict(), os.path.join(output_dir, f"generator_{generator_num}.pth"))
+    atomic_save({
+        "generator": unwrap(generator).state_dict(),
+        "discriminator": unwrap(discriminator).state_dict(),
+        "opt_g": opt_g.state_dict(),
+        "opt_d": opt_d.state_dict(),
+        "scaler": scaler.state_dict(),
+        "epoch": epoch,
+        "step": step,
+    }, checkpoint_path(output_dir, generator_num))
+
+def setup_distributed(backend):
+    """Join the process group when launched with torchrun; return (rank, world_size, local_rank)."""
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    if world_size > 1:
+        dist.init_process_group(backend=backend)
+        return dist.get_rank(), world_size, int(os.environ.get("LOCAL_RANK", "0"))
+    return 0, 1, 0
+
+def amp_settings(device, enabled):
+    """fp16 with loss scaling on CUDA, bf16 autocast on CPU, or plain fp32."""
+    if not enabled:
+        return None, False
+    if device.type == "cuda":
+        return torch.float16, True
+    return torch.bfloat16, False
+
+def train(args):
+    rank, world_size, local_rank = setup_distributed(args.backend)
+    if torch.cuda.is_available() and args.backend == "nccl":
+        device = torch.device("cuda", local_rank)
+        torch.cuda.set_device(device)
+    else:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if device.type == "cpu" and args.threads_per_process:
+        torch.set_num_threads(args.threads_per_process)
+
+    # Data: packed shards are read zero-copy, folders go through the PIL transform
+    if args.packed_dir:
+        dataset = PackedSketchDataset(args.packed_dir)
+        needs_normalize = True
+    else:
+        dataset = SketchToImageDataset(args.sketch_dir, args.real_dir, transform=transform)
+        needs_normalize = False
+    sampler = DistributedSampler(dataset, num_replicas=world_size, rank=rank, shuffle=True) if world_size > 1 else None
+    data_loader = make_data_loader(dataset, batch_size=args.batch_size, num_workers=args.num_workers,
+                                   sampler=sampler)
+
+    # Models and optimizers
+    Generator = load_generator_module(args.generator_num)
+    generator = Generator().to(device)
+    discriminator = load_discriminator(args.generator_num).to(device)
+    opt_g = optim.Adam(generator.parameters(), lr=args.lr, betas=(0.5, 0.999))
+    opt_d = optim.Adam(discriminator.parameters(), lr=args.lr, betas=(0.5, 0.999))
+    amp_dtype, use_scaler = amp_settings(device, args.amp)
+    scaler = torch.cuda.amp.GradScaler(enabled=use_scaler)
+
+    # Resume from the full training state if there is one
+    start_epoch, step = 0, 0
+    resume_path = checkpoint_path(args.output_dir, args.generator_num)
+    if args.resume and os.path.exists(resume_path):
+        state = torch.load(resume_path, map_location=device)
+        generator.load_state_dict(state["generator"])
+        discriminator.load_state_dict(state["discriminator"])
+        opt_g.load_state_dict(state["opt_g"])
+        opt_d.load_state_dict(state["opt_d"])
+        scaler.load_state_dict(state["scaler"])
+        start_epoch, step = state["epoch"], state["step"]
+        if rank == 0:
+            print(f"Resumed from {resume_path} at epoch {start_epoch}, step {step}")
+
+    if world_size > 1:
+        device_ids = [device.index] if device.type == "cuda" else None
+        generator = DistributedDataParallel(generator, device_ids=device_ids)
+        # D runs several forwards per step (real, fake, and again in the G step); broadcasting its
+        # BatchNorm buffers before each one would overwrite buffers autograd still needs
+        discriminator = DistributedDataParallel(discriminator, device_ids=device_ids, broadcast_buffers=False)
+
+    def autocast():
+        return torch.autocast(device_type=device.type, dtype=amp_dtype, enabled=amp_dtype is not None)
+
+    def maybe_no_sync(model, sync):
+        # Skip the gradient all-reduce on accumulation micro-steps
+        if sync or not isinstance(model, DistributedDataParallel):
+            return contextlib.nullcontext()
+        return model.no_sync()
+
+    for epoch in range(start_epoch, args.epochs):
+        if sampler is not None:
+            sampler.set_epoch(epoch)
+        generator.train()
+        discriminator.train()
+        epoch_start = time.perf_counter()
+        for i, (sketch, real) in enumerate(data_loader):
+            sketch = sketch.to(device, non_blocking=True)
+            real = real.to(device, non_blocking=True)
+            if needs_normalize:
+                sketch, real = normalize_batch(sketch), normalize_batch(real)
+            sync = (i + 1) % args.accum_steps == 0
+
+            # DDP decides whether to all-reduce gradients during the forward pass
+            with maybe_no_sync(generator, sync), autocast():
+                fake = generator(sketch)
+
+            # Discriminator: real images vs detached fakes
+            with maybe_no_sync(discriminator, sync), autocast():
+                loss_d = (adversarial_loss(discriminator(real), True)
+                          + adversarial_loss(discriminator(fake.detach()), False)) / 2
+            scaler.scale(loss_d / args.accum_steps).backward()
+
+            # Generator: fool the discriminator and stay close to the real image. The unwrapped,
+            # frozen discriminator keeps these gradients out of its own accumulated update.
+            d_module = unwrap(discriminator)
+            d_module.requires_grad_(False)
+            with autocast():
+                loss_g = adversarial_loss(d_module(fake), True) + args.lambda_l1 * F.l1_loss(fake.float(), real)
+            scaler.scale(loss_g / args.accum_steps).backward()
+            d_module.requires_grad_(True)
+
+            if sync:
+                scaler.step(opt_d)
+                scaler.step(opt_g)
+                scaler.update()
+                opt_d.zero_grad(set_to_none=True)
+                opt_g.zero_grad(set_to_none=True)
+                step += 1
+                if rank == 0 and step % args.log_every == 0:
+                    print(f"Epoch {epoch} step {step}: loss_d {loss_d.item():.4f}, loss_g {loss_g.item():.4f}")
+                if rank == 0 and args.checkpoint_every and step % args.checkpoint_every == 0:
+                    save_checkpoint(args.output_dir, args.generator_num, generator, discriminator,
+                                    opt_g, opt_d, scaler, epoch, step)
+
+        if rank == 0:
+            print(f"Epoch {epoch} finished in {time.perf_counter() - epoch_start:.1f} s")
+            save_checkpoint(args.output_dir, args.generator_num, generator, discriminator,
+                            opt_g, opt_d, scaler, epoch + 1, step)
+
+    if world_size > 1:
+        dist.destroy_process_group()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Train a sketch-to-image generator. Launch with torchrun --nproc_per_node=N for DDP."
+    )
+    parser.add_argument("--generator_num", type=int, default=1, choices=[1, 2, 3],
+                        help="Generator to train; 2 uses sketch_to_image_gan_2, 1 and 3 sketch_to_image_gan.")
+    parser.add_argument("--packed_dir", type=str, default=None, help="Directory written by pack_dataset.py.")
+    parser.add_argument("--sketch_dir", type=str, default=None, help="Directory of sketches (unpacked dataset).")
+    parser.add_argument("--real_dir", type=str, default=None, help="Directory of real images (unpacked dataset).")
+    parser.add_argument("--output_dir", type=str, default=MODEL_DIR,
+                        help="Where generator_{n}.pth and checkpoint_{n}.pt are written. Default is Model_1.")
+    parser.add_argument("--epochs", type=int, default=100, help="Number of epochs. Default is 100.")
+    parser.add_argument("--batch_size", type=int, default=4, help="Per-process batch size. Default is 4.")
+    parser.add_argument("--accum_steps", type=int, default=1, help="Gradient accumulation steps. Default is 1.")
+    parser.add_argument("--lr", type=float, default=2e-4, help="Adam learning rate. Default is 2e-4.")
+    parser.add_argument("--lambda_l1", type=float, default=100.0, help="Weight of the L1 loss. Default is 100.")
+    parser.add_argument("--amp", action="store_true", help="Mixed precision: fp16 on CUDA, bf16 on CPU.")
+    parser.add_argument("--backend", type=str, default="gloo", choices=["gloo", "nccl"],
+                        help="torch.distributed backend. Default is gloo.")
+    parser.add_argument("--threads_per_process", type=int, default=None,
+                        help="torch.set_num_threads per process on CPU, to avoid oversubscribing cores.")
+    parser.add_argument("--num_workers", type=int, default=4, help="DataLoader worker processes. Default is 4.")
+    parser.add_argument("--checkpoint_every", type=int, default=500,
+                        help="Optimizer steps between checkpoints (0 = end of epoch only). Default is 500.")
+    parser.add_argument("--log_every", type=int, default=50, help="Optimizer steps between log lines. Default is 50.")
+    parser.add_argument("--resume", action="store_true", help="Resume from checkpoint_{n}.pt in output_dir.")
+    parser.add_argument("--check_data", action="store_true", help="Only load one batch and print its shapes.")
+    args = parser.parse_args()
+
+    if not args.packed_dir and not (args.sketch_dir and args.real_dir):
+        parser.error("either --packed_dir or both --sketch_dir and --real_dir are required")
+
+    if args.check_data:
+        # Load dataset
+        if args.packed_dir:
+            dataset = PackedSketchDataset(args.packed_dir)
+        else:
+            dataset = SketchToImageDataset(args.sketch_dir, args.real_dir, transform=transform)
+        data_loader = make_data_loader(dataset, batch_size=args.batch_size, num_workers=args.num_workers)
 
-# Check batch
-for sketch, real in data_loader:
-    print(f"Sketch shape: {sketch.shape}, Real shape: {real.shape}")
-    break
+        # Check batch
+        for sketch, real in data_loader:
+            print(f"Sketch shape: {sketch.shape}, Real shape: {real.shape}")
+            break
+    else:
+        train(args)